@@ -1,10 +1,14 @@
+import os
+
 import matplotlib.pyplot as plt
 import pandas as pd
 from IPython.core.display import display, HTML
-from PyQt5.QtWidgets import QMessageBox
+from PyQt5.QtWidgets import QMessageBox, QFileDialog
 from PyQt5.QtCore import Qt
 from scipy.io import loadmat
 
+import datastore
+
 
 def superscript(n):
     return "".join(["⁰¹²³⁴⁵⁶⁷⁸⁹"[ord(c) - ord('0')] for c in str(n)])
@@ -82,25 +86,48 @@ def view_image(image):
 
 def bring_df_to_positive_coord(df):
     """
-        To make all the coordinates ('X', 'Y', 'Z') in the dataset offset by the minimum value and into positive side
+        To make all the coordinates ('X', 'Y', 'Z') in the dataset offset by the minimum value and into positive side.
+        The shifted columns are new arrays, so frames opened from the shared dataset store are not written into
         :param df: pandas.DataFrame
         :return: pandas.DataFrame
         """
     if (df["X"] < 0).any().any():
         x_offset = abs(df['X'].min())
-        df['X'] = df['X'] + x_offset
+        datastore.derive_column(df, 'X', df['X'] + x_offset)
 
     if (df["Y"] < 0).any().any():
         y_offset = abs(df['Y'].min())
-        df['Y'] = df['Y'] + y_offset
+        datastore.derive_column(df, 'Y', df['Y'] + y_offset)
 
     if (df["Z"] < 0).any().any():
         z_offset = abs(df['Z'].min())
-        df['Z'] = df['Z'] + z_offset
+        datastore.derive_column(df, 'Z', df['Z'] + z_offset)
 
     return df
 
 
+def input_dataset(parent, current=False, columns=None):
+    """
+        Reads the input of an analysis dialog: the current ranged dataset of the main window from the shared dataset
+        store (no disk round trip, the columns are shared read-only) or a selected HDF file through the dataset cache
+        :param parent: dialog
+        :param current: True for the dataset of the main window
+        :param columns: list of columns to read, None reads all
+        :return: (store handle, dataset name or file path, pandas.DataFrame)
+        """
+    if current:
+        if not datastore.has_dataset(datastore.current_dataset):
+            show_message("Map the peaks in the main window first to analyse its dataset")
+            raise KeyError(datastore.current_dataset)
+        handle, df = datastore.open_dataset(datastore.current_dataset, columns)
+        return handle, datastore.current_dataset, df
+
+    file = QFileDialog.getOpenFileName(parent, 'Select HDF File"', os.getcwd(), "HDF files (*.h5)")
+    # recently used files are served from the dataset cache
+    handle, df = datastore.load_dataset(file[0], columns)
+    return handle, file[0], df
+
+
 def print_dataframe_full(df):
     """
     Displays the whole dataframe regardless of the size
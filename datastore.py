@@ -0,0 +1,495 @@
+import ast
+import atexit
+import os
+import shutil
+import tempfile
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+# key of the ion table in the exported HDF files and of the species lookup table next to it
+dataset_key = 'df_apt_final'
+species_key = 'species'
+# compression of the exported HDF files (table format, blosc falls back to zlib if PyTables was built without it)
+hdf_complib = 'blosc'
+hdf_complevel = 5
+# rows written per chunk
+hdf_chunk_rows = 1000000
+# per ion columns that only depend on the species, they are stored once per species in the lookup table
+species_columns = ['ION', 'ion', 'num', 'mass', 'charge']
+
+
+def _complib():
+    import tables
+    if hdf_complib.split(':')[0] == 'blosc' and tables.which_lib_version('blosc') is None:
+        return 'zlib'
+    return hdf_complib
+
+
+def encode_species(df):
+    """
+    Replaces the ION label and the columns depending on it by integer codes, in one factorization
+    :param df: pandas.DataFrame with column ION
+    :return: (numpy.array of int32 codes, pandas.DataFrame lookup table with one row per code)
+    """
+    codes, labels = pd.factorize(df['ION'], sort=True)
+    first = np.unique(codes, return_index=True)[1]
+    lookup = pd.DataFrame({'code': np.arange(len(labels), dtype=np.int32), 'ION': np.asarray(labels, dtype=str)})
+    # the list columns of the ion table are kept as text, one value per species
+    for column in species_columns[1:]:
+        if column in df.columns:
+            lookup[column] = [str(value) for value in df[column].values[first]]
+    return codes.astype(np.int32), lookup
+
+
+def typed_frame(df, float_columns=(), int_columns=(), bool_columns=()):
+    """
+    Casts the columns of an ion table to explicit numeric dtypes, whole columns at a time. Columns that are not listed
+    keep their numeric dtype, other object columns are stored as text. The index of df is kept
+    :param df: pandas.DataFrame
+    :param float_columns: columns stored as float64
+    :param int_columns: columns stored as int64
+    :param bool_columns: columns stored as bool
+    :return: pandas.DataFrame (new frame, df is not changed)
+    """
+    columns = {}
+    for column in df.columns:
+        values = df[column]
+        if column in float_columns:
+            values = pd.to_numeric(values, errors='coerce').astype(np.float64)
+        elif column in int_columns:
+            values = pd.to_numeric(values).astype(np.int64)
+        elif column in bool_columns:
+            values = values.fillna(False).astype(bool)
+        elif values.dtype == object:
+            values = values.astype(str)
+        columns[column] = values.values
+    return pd.DataFrame(columns, index=df.index)
+
+
+def write_dataset(path, df, float_columns=(), int_columns=(), bool_columns=(), key=dataset_key):
+    """
+    Writes an ion table as compressed HDF file in table format, together with its index. The species (ION) are stored
+    as int32 codes in column species with the lookup table under key_species, so that no column has to be pickled
+    :param path: file path (.h5)
+    :param df: pandas.DataFrame of the ions
+    :param float_columns: columns stored as float64
+    :param int_columns: columns stored as int64
+    :param bool_columns: columns stored as bool
+    :param key: key of the ion table in the file
+    """
+    lookup = None
+    if 'ION' in df.columns:
+        codes, lookup = encode_species(df)
+        df = df.drop(columns=[column for column in species_columns if column in df.columns])
+    df = typed_frame(df, float_columns, int_columns, bool_columns)
+    if lookup is not None:
+        df['species'] = codes
+
+    complib = _complib()
+    with pd.HDFStore(path, mode='w', complib=complib, complevel=hdf_complevel) as store:
+        store.append(key, df, format='table', index=False, chunksize=hdf_chunk_rows, expectedrows=len(df),
+                     data_columns=['species'] if lookup is not None else None)
+        if lookup is not None:
+            # where queries on the species read only the matching chunks
+            store.create_table_index(key, columns=['species'], optlevel=6, kind='medium')
+            store.append(key + '_' + species_key, lookup, format='table', index=False)
+
+
+def read_dataset(path, columns=None, species=None, key=None):
+    """
+    Reads an ion table written by write_dataset (the species codes are decoded to the ION column) or any single
+    table HDF file written by pandas. For table format files only the requested columns and the rows of the requested
+    species are read from disk, other files are read completely and selected afterwards
+    :param path: file path (.h5)
+    :param columns: list of columns to read (ION and the species columns are read through the species codes), None
+    reads all
+    :param species: list of ION labels whose rows are read, None reads all
+    :param key: key of the ion table, by default dataset_key if present, else the only table of the file
+    :return: pandas.DataFrame
+    """
+    with pd.HDFStore(path, mode='r') as store:
+        keys = [name.lstrip('/') for name in store.keys()]
+        if key is None:
+            tables = [name for name in keys if not name.endswith('_' + species_key)]
+            key = dataset_key if dataset_key in tables else tables[0]
+        lookup_key = key + '_' + species_key
+        lookup = store.select(lookup_key) if lookup_key in keys else None
+
+        if not store.get_storer(key).is_table:
+            df = store.select(key)
+            if species is not None:
+                df = df[df['ION'].isin(species)]
+            return df if columns is None else df[[column for column in columns if column in df.columns]]
+
+        select_columns, where = None, None
+        if columns is not None:
+            select_columns = [column for column in columns if column not in species_columns]
+            if lookup is not None and len(select_columns) < len(columns):
+                select_columns.append('species')
+        if species is not None and lookup is not None:
+            codes = lookup['code'].values[np.isin(lookup['ION'].values, species)].tolist()
+            where = 'species in %s' % codes if codes else 'species < 0'
+        df = store.select(key, where=where, columns=select_columns)
+        if lookup is not None and 'species' in df.columns:
+            df = decode_species(df, lookup, columns)
+        elif species is not None and 'ION' in df.columns:
+            df = df[df['ION'].isin(species)]
+    return df
+
+
+def decode_species(df, lookup, columns=None):
+    """
+    Restores the ION column and the species columns from the species codes, the list columns are parsed once per
+    species
+    :param df: pandas.DataFrame with column species
+    :param lookup: lookup table written by write_dataset
+    :param columns: species columns to restore, None restores all
+    :return: pandas.DataFrame without the species column
+    """
+    position = pd.Index(lookup['code'].values).get_indexer(df['species'].values)
+    df = df.drop(columns=['species'])
+    for column in species_columns:
+        if column in lookup.columns and (columns is None or column in columns):
+            values = lookup[column].values
+            if column != 'ION':
+                values = np.empty(len(lookup), dtype=object)
+                values[:] = [ast.literal_eval(value) for value in lookup[column].values]
+            df[column] = values[position]
+    return df
+
+
+# name of the ranged dataset of the main window in the shared store
+current_dataset = 'current ranged dataset'
+# memory (bytes) the datasets read from files may take, least recently used ones beyond it are moved to memory mapped
+# files in cache_dir (None uses a temporary directory that is removed at exit)
+cache_budget = 4 * 1024 ** 3
+cache_dir = None
+# pandas before 3.0 copies the blocks in concat unless copy=False, since 3.0 the keyword is deprecated (copy on write
+# never copies them)
+_concat_options = {'copy': False} if int(pd.__version__.split('.')[0]) < 3 else {}
+# datasets shared between the windows of the process: name -> entry dict with the read-only columns, the index and the
+# number of open handles
+_datasets = {}
+
+
+def _readonly(values):
+    values = np.asarray(values)
+    if values.flags.writeable:
+        values = values.view()
+        values.flags.writeable = False
+    return values
+
+
+def publish_dataset(name, df):
+    """
+    Shares a dataset with all windows of the process. The columns are kept as read-only arrays (views, no copy), so
+    the publisher must not change df in place afterwards. A dataset published under the same name is replaced, frames
+    opened from it stay valid
+    :param name: dataset name
+    :param df: pandas.DataFrame
+    """
+    columns = {column: _readonly(df[column].to_numpy()) for column in df.columns}
+    _datasets[name] = {'name': name, 'columns': columns, 'index': df.index, 'refs': 0}
+
+
+def has_dataset(name):
+    """
+    :param name: dataset name
+    :return: True if a dataset was published under the name
+    """
+    return name in _datasets
+
+
+def dataset_frame(columns, index):
+    """
+    DataFrame referencing the given arrays, one block per column so that pandas does not consolidate them into a copy
+    :param columns: dict column -> numpy.array
+    :param index: pandas.Index
+    :return: pandas.DataFrame
+    """
+    if not columns:
+        return pd.DataFrame(index=index)
+    frames = [pd.Series(values, index=index, name=column, copy=False).to_frame() for column, values in columns.items()]
+    return pd.concat(frames, axis=1, **_concat_options)
+
+
+def open_dataset(name, columns=None):
+    """
+    Opens a shared dataset without copying its columns. Columns added to the frame belong to the caller, shared
+    columns are replaced with derive_column (copy on write), writing into them in place raises an error
+    :param name: dataset name
+    :param columns: list of columns, None opens all
+    :return: (handle for release_dataset, pandas.DataFrame)
+    """
+    entry = _datasets[name]
+    selected = entry['columns'] if columns is None else \
+        {column: entry['columns'][column] for column in columns if column in entry['columns']}
+    entry['refs'] += 1
+    return entry, dataset_frame(selected, entry['index'])
+
+
+def release_dataset(handle):
+    """
+    Releases a handle of open_dataset (None is ignored)
+    :param handle: handle returned by open_dataset
+    """
+    if handle is not None and handle['refs'] > 0:
+        handle['refs'] -= 1
+        if handle['refs'] == 0:
+            _enforce_budget()
+
+
+def derive_column(df, column, values):
+    """
+    Sets a column without writing into the array it held, so that shared read-only columns are copied on write
+    :param df: pandas.DataFrame (changed in place)
+    :param column: column name
+    :param values: new values
+    """
+    values = np.asarray(values)
+    if column in df.columns:
+        position = df.columns.get_loc(column)
+        del df[column]
+        df.insert(position, column, values)
+    else:
+        df[column] = values
+
+
+def dataset_info():
+    """
+    Size and open handles of the shared datasets
+    :return: list of dicts with keys name, rows, columns, nbytes, refs
+    """
+    return [{'name': name, 'rows': len(entry['index']), 'columns': len(entry['columns']),
+             'nbytes': sum(values.nbytes for values in entry['columns'].values()), 'refs': entry['refs']}
+            for name, entry in _datasets.items()]
+
+
+# datasets read from files, least recently used first: (path, modification time) -> entry dict like _datasets with the
+# memory mapped columns and the columns written to spill files (with the labels of the text columns)
+_file_cache = OrderedDict()
+_cache_stats = {'hits': 0, 'mapped_hits': 0, 'misses': 0}
+_spill_dir = None
+
+
+def load_dataset(path, columns=None):
+    """
+    Opens a dataset file through the LRU cache: recently used datasets stay resident up to cache_budget, older ones are
+    memory mapped (and read back into memory when they are used again and fit the budget), so that switching between
+    datasets does not read the HDF files again. Only the columns not cached yet are read. The frame shares the cached
+    read-only columns like open_dataset
+    :param path: file path (.h5)
+    :param columns: list of columns, None opens all
+    :return: (handle for release_dataset, pandas.DataFrame)
+    """
+    path = os.path.abspath(path)
+    key = (path, os.stat(path).st_mtime_ns)
+    for old_key in [old_key for old_key in _file_cache if old_key[0] == path and old_key != key]:
+        _drop_entry(_file_cache.pop(old_key))
+
+    entry = _file_cache.get(key)
+    if entry is None:
+        entry = {'name': path, 'columns': {}, 'index': None, 'refs': 0, 'complete': False, 'absent': set(),
+                 'mapped': set(), 'files': {}}
+        _file_cache[key] = entry
+    if entry['complete']:
+        missing = []
+    elif columns is None:
+        missing = None if entry['index'] is None else \
+            [column for column in read_columns(path) if column not in entry['columns']]
+    else:
+        missing = [column for column in columns if column not in entry['columns'] and column not in entry['absent']]
+
+    if entry['index'] is not None and missing == []:
+        _cache_stats['mapped_hits' if entry['mapped'] else 'hits'] += 1
+    else:
+        _cache_stats['misses'] += 1
+        df = read_dataset(path, columns=missing)
+        for column in df.columns:
+            entry['columns'].setdefault(column, _readonly(df[column].to_numpy()))
+        if entry['index'] is None:
+            entry['index'] = df.index
+        if missing is None:
+            entry['complete'] = True
+        else:
+            entry['absent'].update(column for column in missing if column not in df.columns)
+
+    _file_cache.move_to_end(key)
+    entry['refs'] += 1
+    _enforce_budget()
+    if columns is None:
+        columns = list(entry['columns'])
+    selected = {column: _decode(entry['columns'][column]) for column in columns if column in entry['columns']}
+    frame = dataset_frame(selected, entry['index'])
+    return entry, frame
+
+
+def complete_frame(handle, df):
+    """
+    Adds the columns of the dataset that were not opened to a frame of open_dataset or load_dataset, so that the
+    complete ion table can be exported after an analysis that only read a few of its columns
+    :param handle: handle the frame was opened with
+    :param df: pandas.DataFrame opened with handle, its rows must not have been filtered or reordered
+    :return: pandas.DataFrame with the columns of df followed by the other columns of the dataset
+    """
+    if 'complete' in handle:
+        # dataset file, the columns not cached yet are read
+        full_handle, full = load_dataset(handle['name'])
+        release_dataset(full_handle)
+    else:
+        full = dataset_frame(handle['columns'], handle['index'])
+    if len(full) != len(df):
+        raise ValueError("the dataset %s changed since it was opened" % handle['name'])
+    columns = {column: df[column].to_numpy() for column in df.columns}
+    columns.update((column, full[column].to_numpy()) for column in full.columns if column not in df.columns)
+    return dataset_frame(columns, df.index)
+
+
+def read_columns(path, key=None):
+    """
+    Column names of a dataset file without reading its rows (ION and the species columns for files of write_dataset)
+    :param path: file path (.h5)
+    :param key: key of the ion table, by default as read_dataset
+    :return: list of column names
+    """
+    with pd.HDFStore(path, mode='r') as store:
+        keys = [name.lstrip('/') for name in store.keys()]
+        if key is None:
+            tables = [name for name in keys if not name.endswith('_' + species_key)]
+            key = dataset_key if dataset_key in tables else tables[0]
+        storer = store.get_storer(key)
+        if storer.is_table:
+            columns = list(storer.non_index_axes[0][1])
+        else:
+            columns = list(store.select(key, start=0, stop=0).columns)
+        if 'species' in columns and key + '_' + species_key in keys:
+            lookup = store.select(key + '_' + species_key, start=0, stop=0)
+            columns.remove('species')
+            columns += [column for column in species_columns if column in lookup.columns]
+    return columns
+
+
+def _spill_path(entry):
+    global _spill_dir
+    if _spill_dir is None:
+        if cache_dir is None:
+            _spill_dir = tempfile.mkdtemp(prefix='apt_datasets_')
+            atexit.register(shutil.rmtree, _spill_dir, True)
+        else:
+            os.makedirs(cache_dir, exist_ok=True)
+            _spill_dir = cache_dir
+            # the spill files are named per process, they are of no use to a later session
+            atexit.register(clear_cache)
+    return os.path.join(_spill_dir, '%016x' % (hash(entry['name']) & 0xffffffffffffffff))
+
+
+def _decode(values):
+    # spilled text columns are kept as memory mapped codes with their labels and only decoded for the opened frames
+    if isinstance(values, tuple):
+        codes, labels = values
+        return _readonly(labels[codes])
+    return values
+
+
+def _column_bytes(values):
+    # (resident, memory mapped) bytes of a cached column
+    if isinstance(values, tuple):
+        codes, labels = values
+        return labels.nbytes, codes.nbytes
+    if isinstance(values, np.memmap):
+        return 0, values.nbytes
+    return values.nbytes, 0
+
+
+def _spill_entry(entry):
+    # the columns are written as .npy files and mapped read-only, text columns as int32 codes with their labels.
+    # Columns that have a spill file from an earlier spill are only mapped again
+    directory = _spill_path(entry)
+    os.makedirs(directory, exist_ok=True)
+    for i, (column, values) in enumerate(entry['columns'].items()):
+        if column in entry['mapped']:
+            continue
+        file_name = os.path.join(directory, '%d.npy' % i)
+        if column not in entry['files']:
+            labels = None
+            if values.dtype == object:
+                try:
+                    codes, labels = pd.factorize(values)
+                except TypeError:
+                    # the lists of the species columns are shared per species, they are coded by identity
+                    codes = pd.factorize(np.fromiter(map(id, values), dtype=np.int64, count=len(values)))[0]
+                    labels = values[np.unique(codes, return_index=True)[1]]
+                values = codes.astype(np.int32)
+                labels = np.asarray(labels, dtype=object)
+            np.save(file_name, values)
+            entry['files'][column] = labels
+        values = np.load(file_name, mmap_mode='r')
+        if entry['files'][column] is not None:
+            values = (values, entry['files'][column])
+        entry['columns'][column] = values
+        entry['mapped'].add(column)
+
+
+def _reload_bytes(entry):
+    # memory the mapped columns of an entry take once they are read back (decoded text columns hold 8 byte references)
+    return sum(values[0].size * 8 if isinstance(values, tuple) else values.nbytes
+               for column, values in entry['columns'].items() if column in entry['mapped'])
+
+
+def _reload_entry(entry):
+    # the mapped columns are read back into memory, their spill files are kept for the next spill
+    for column in entry['mapped']:
+        values = entry['columns'][column]
+        entry['columns'][column] = _decode(values) if isinstance(values, tuple) else _readonly(np.array(values))
+    entry['mapped'] = set()
+
+
+def _drop_entry(entry):
+    entry['columns'] = {}
+    entry['mapped'] = set()
+    if entry['files']:
+        shutil.rmtree(_spill_path(entry), ignore_errors=True)
+        entry['files'] = {}
+
+
+def _enforce_budget():
+    # the least recently used datasets without open frames are memory mapped until the resident ones fit the budget,
+    # then the most recently used mapped datasets are read back into memory as long as they fit
+    entries = list(_file_cache.values())
+    for entry in entries[:-1]:
+        if cache_report()['resident_bytes'] <= cache_budget:
+            break
+        if entry['refs'] == 0 and len(entry['mapped']) < len(entry['columns']):
+            _spill_entry(entry)
+    for entry in reversed(entries):
+        if entry['mapped'] and cache_report()['resident_bytes'] + _reload_bytes(entry) <= cache_budget:
+            _reload_entry(entry)
+
+
+def cache_report():
+    """
+    State of the dataset cache
+    :return: dict with keys hits, mapped_hits, misses, hit_rate, datasets, resident_bytes (in memory), mapped_bytes
+    (memory mapped files), shared_bytes (published datasets)
+    """
+    requests = _cache_stats['hits'] + _cache_stats['mapped_hits'] + _cache_stats['misses']
+    resident, mapped = 0, 0
+    for entry in _file_cache.values():
+        for values in entry['columns'].values():
+            column_resident, column_mapped = _column_bytes(values)
+            resident += column_resident
+            mapped += column_mapped
+    return {'hits': _cache_stats['hits'], 'mapped_hits': _cache_stats['mapped_hits'], 'misses': _cache_stats['misses'],
+            'hit_rate': (_cache_stats['hits'] + _cache_stats['mapped_hits']) / requests if requests else 0.0,
+            'datasets': len(_file_cache), 'resident_bytes': resident, 'mapped_bytes': mapped,
+            'shared_bytes': sum(info['nbytes'] for info in dataset_info())}
+
+
+def clear_cache():
+    """
+    Removes all datasets read from files (open frames stay valid) and their memory mapped files
+    """
+    while _file_cache:
+        _drop_entry(_file_cache.popitem(last=False)[1])
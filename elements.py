@@ -0,0 +1,186 @@
+import csv
+import os
+import re
+from functools import lru_cache
+
+import numpy as np
+
+# The element and isotope tables are shipped in Extras next to the program
+data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Extras')
+element_file = os.path.join(data_dir, 'elements.csv')
+isotope_file = os.path.join(data_dir, 'isotopes.csv')
+# isotopic peaks of a molecular ion below this fraction of the most abundant one are dropped
+isotope_min_abundance = 1e-4
+# isotopic peaks of a molecular ion closer than this (Da) are merged into one
+isotope_merge_width = 0.001
+# number of molecular ion patterns kept in memory
+isotope_cache_size = 4096
+
+_elements = None
+_element_index = None
+_isotopes = None
+
+
+def load_elements():
+    """
+    Reads the bundled element table once into column arrays (symbol, Z, name, mass, row, column, category). row and
+    column give the position in the periodic table, the lanthanides and actinides are in rows 9 and 10. Deuterium is
+    listed as its own element D next to hydrogen
+    :return: dict of numpy.arrays
+    """
+    global _elements, _element_index
+    if _elements is None:
+        with open(element_file, 'r') as fileInput:
+            rows = list(csv.DictReader(fileInput))
+        _elements = {
+            'symbol': np.array([row['symbol'] for row in rows]),
+            'Z': np.array([int(row['Z']) for row in rows], dtype=np.int64),
+            'name': np.array([row['name'] for row in rows]),
+            'mass': np.array([float(row['mass']) for row in rows], dtype=np.float64),
+            'row': np.array([int(row['row']) for row in rows], dtype=np.int64),
+            'column': np.array([int(row['column']) for row in rows], dtype=np.int64),
+            'category': np.array([row['category'] for row in rows])
+        }
+        _element_index = {symbol: i for i, symbol in enumerate(_elements['symbol'])}
+    return _elements
+
+
+def element_index(symbol):
+    """
+    Position of an element in the arrays of load_elements, O(1)
+    :param symbol: element symbol, e.g. 'Fe' or 'D'
+    :return: int
+    """
+    load_elements()
+    if symbol not in _element_index:
+        raise KeyError("Unknown element " + str(symbol))
+    return _element_index[symbol]
+
+
+def element(symbol):
+    """
+    All properties of one element
+    :param symbol: element symbol
+    :return: dict with keys symbol, Z, name, mass, row, column, category
+    """
+    table = load_elements()
+    i = element_index(symbol)
+    return {key: values[i].item() for key, values in table.items()}
+
+
+def atomic_masses(symbols):
+    """
+    Standard atomic masses of a list of symbols in one lookup
+    :param symbols: iterable of element symbols
+    :return: numpy.array of masses (Da)
+    """
+    return load_elements()['mass'][[element_index(symbol) for symbol in symbols]]
+
+
+def load_isotopes():
+    """
+    Reads the bundled isotope table once (natural isotopes with mass in Da and abundance as fraction). Deuterium is
+    listed as its own symbol D with a single isotope, elements without natural isotopic composition (Tc, Pm, Po and
+    the heavier ones except Th, Pa and U) with their longest-lived isotope
+    :return: dict symbol -> (numpy.array of masses, numpy.array of abundances)
+    """
+    global _isotopes
+    if _isotopes is None:
+        table = {}
+        with open(isotope_file, 'r') as fileInput:
+            for row in csv.DictReader(fileInput):
+                table.setdefault(row['symbol'], []).append((float(row['mass']), float(row['abundance'])))
+        _isotopes = {}
+        for symbol, values in table.items():
+            values = np.array(values, dtype=np.float64)
+            _isotopes[symbol] = (values[:, 0], values[:, 1])
+    return _isotopes
+
+
+def charge_number(charge):
+    """
+    Charge state of an ion table entry
+    :param charge: int or text as stored in the ion table, e.g. '2+', '+', ['1+']
+    :return: int (at least 1)
+    """
+    if isinstance(charge, (list, tuple)):
+        charge = charge[0] if len(charge) else 1
+    if isinstance(charge, str):
+        digits = re.sub(r'\D', '', charge)
+        charge = int(digits) if digits else 1
+    return max(1, abs(int(charge)))
+
+
+def formula_key(ions, nums):
+    """
+    Canonical formula of a molecular ion so that e.g. ['O', 'H', 'O'] / [1, 1, 1] and ['H', 'O'] / [1, 2] share a key
+    :param ions: list of element symbols
+    :param nums: list of atom counts (int or text, empty means 1)
+    :return: tuple of (symbol, count) sorted by symbol
+    """
+    counts = {}
+    for symbol, num in zip(ions, nums):
+        num = int(num) if str(num).strip() != '' else 1
+        counts[str(symbol)] = counts.get(str(symbol), 0) + num
+    return tuple(sorted((symbol, num) for symbol, num in counts.items() if num > 0))
+
+
+def _merge_peaks(masses, abundances):
+    # peaks closer than isotope_merge_width are combined at their abundance weighted mass
+    keys = np.rint(masses / isotope_merge_width).astype(np.int64)
+    unique_keys, inverse = np.unique(keys, return_inverse=True)
+    merged_abundance = np.bincount(inverse, weights=abundances, minlength=len(unique_keys))
+    merged_mass = np.bincount(inverse, weights=masses * abundances, minlength=len(unique_keys)) / merged_abundance
+    keep = merged_abundance >= isotope_min_abundance * merged_abundance.max()
+    return merged_mass[keep], merged_abundance[keep]
+
+
+@lru_cache(maxsize=isotope_cache_size)
+def _formula_pattern(formula, charge):
+    isotopes = load_isotopes()
+    masses = np.zeros(1)
+    abundances = np.ones(1)
+    for symbol, num in formula:
+        if symbol not in isotopes:
+            element_index(symbol)
+            raise KeyError("No natural isotopes known for " + symbol)
+        element_mass, element_abundance = isotopes[symbol]
+        for _ in range(num):
+            masses = (masses[:, None] + element_mass[None, :]).ravel()
+            abundances = (abundances[:, None] * element_abundance[None, :]).ravel()
+            masses, abundances = _merge_peaks(masses, abundances)
+
+    mn_ratio = masses / charge
+    order = np.argsort(mn_ratio)
+    mn_ratio, abundances = mn_ratio[order], abundances[order]
+    # the cached arrays are shared between callers
+    mn_ratio.flags.writeable = False
+    abundances.flags.writeable = False
+    return mn_ratio, abundances
+
+
+def isotope_pattern(ions, nums, charge):
+    """
+    Positions and natural abundances of the isotopic peaks of a molecular ion. Results are memoized by formula and
+    charge state, so repeated ions of large range tables cost a dictionary lookup
+    :param ions: list of element symbols, e.g. ['Al', 'O']
+    :param nums: list of atom counts, e.g. ['1', '1']
+    :param charge: charge state as stored in the ion table, e.g. '1+'
+    :return: (numpy.array of m/n peak positions, numpy.array of abundances as fraction), read-only, sorted by m/n
+    """
+    return _formula_pattern(formula_key(ions, nums), charge_number(charge))
+
+
+def isotope_peaks(ions, nums, charge, min_relative=0.01):
+    """
+    Isotopic peaks worth a range of their own
+    :param ions: list of element symbols
+    :param nums: list of atom counts
+    :param charge: charge state as stored in the ion table
+    :param min_relative: minimum abundance relative to the most abundant peak
+    :return: (numpy.array of m/n peak positions, numpy.array of abundances relative to the most abundant peak)
+    """
+    mn_ratio, abundances = isotope_pattern(ions, nums, charge)
+    relative = abundances / abundances.max()
+    keep = relative >= min_relative
+    return mn_ratio[keep], relative[keep]
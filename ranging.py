@@ -0,0 +1,508 @@
+import os
+import re
+
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+import spatial
+import spectrum
+
+# number of classified range rows kept by classify_rows
+range_cache_size = 10000
+# range rows are classified in a process pool of ranging_jobs workers (None uses all but one core) when at least
+# parallel_min_rows rows have to be computed
+ranging_jobs = None
+parallel_min_rows = 8
+# the worker pool is started by the first parallel call and reused by all later ones (the workers keep their imports)
+_pool = None
+_pool_jobs = 0
+# default grid of the cutoff parameter sweep: bin widths, factors applied to the cutoff height of the row and widths
+sweep_bins = [0.1, 0.01, 0.001]
+sweep_height_factors = [0.25, 0.5, 1.0, 2.0, 4.0]
+sweep_widths = [0, 1, 2, 3, 5, 8]
+# colors written to range files, one per distinct ion
+range_colors = ['FF0000', '00A000', '0000FF', 'FF8000', '8000FF', '00C0C0', 'C0C000', 'FF00FF', '808080', '804000']
+
+
+def find_overlaps(low, high):
+    """
+    Finds all ranges that overlap a range starting before them, in O(R log R): the ranges are sorted by their lower
+    limit and compared with the running maximum of the upper limits
+    :param low: numpy.array of lower range limits
+    :param high: numpy.array of upper range limits (closed ranges)
+    :return: numpy.array (K, 2) of (earlier range, overlapping range) indices
+    """
+    low = np.asarray(low, dtype=np.float64)
+    high = np.asarray(high, dtype=np.float64)
+    if len(low) < 2:
+        return np.zeros((0, 2), dtype=np.int64)
+    order = np.argsort(low, kind='stable')
+    low_sorted, high_sorted = low[order], high[order]
+    running_max = np.maximum.accumulate(high_sorted)
+    # position of the range that holds the running maximum
+    holder = np.maximum.accumulate(np.where(high_sorted == running_max, np.arange(len(order)), 0))
+    overlap = np.flatnonzero(low_sorted[1:] <= running_max[:-1]) + 1
+    return np.column_stack([order[holder[overlap - 1]], order[overlap]])
+
+
+def compile_ranges(low, high):
+    """
+    Compiles ranges into sorted, disjoint boundary arrays for the lookup in assign_ranges. Where ranges overlap the
+    one starting first keeps the shared part, ranges lying completely inside an earlier one are left out
+    :param low: numpy.array of lower range limits
+    :param high: numpy.array of upper range limits (closed ranges)
+    :return: dict with keys low, high and id (index of the original range)
+    """
+    low = np.asarray(low, dtype=np.float64)
+    high = np.asarray(high, dtype=np.float64)
+    order = np.argsort(low, kind='stable')
+    low_sorted, high_sorted = low[order], high[order]
+    if len(order) > 1:
+        previous_max = np.concatenate(([-np.inf], np.maximum.accumulate(high_sorted)[:-1]))
+        low_sorted = np.where(low_sorted <= previous_max, np.nextafter(previous_max, np.inf), low_sorted)
+    keep = low_sorted <= high_sorted
+    return {'low': low_sorted[keep], 'high': high_sorted[keep], 'id': order[keep]}
+
+
+def assign_ranges(values, compiled):
+    """
+    Range of every value with one binary search
+    :param values: numpy.array of MN_Ratio values
+    :param compiled: dict from compile_ranges
+    :return: numpy.array of original range indices, -1 outside all ranges
+    """
+    values = np.asarray(values)
+    position = np.searchsorted(compiled['low'], values, side='right') - 1
+    inside = position >= 0
+    inside[inside] = values[inside] <= compiled['high'][position[inside]]
+    return np.where(inside, compiled['id'][np.maximum(position, 0)], -1)
+
+
+def window_histogram(sorted_values, peak_MNRatio, peak_width, cutoff_bin):
+    """
+    Histogram of the window of a range row, with bin edges truncated to the decimals of the bin width
+    :param sorted_values: sorted MN_Ratio values, all of them or the slice inside the window
+    :param peak_MNRatio: center of the window
+    :param peak_width: width of the window
+    :param cutoff_bin: bin width
+    :return: numpy.arrays bin_lower, bin_upper, freq (empty if the window is narrower than two bins)
+    """
+    reciprocal_bins = 1 / cutoff_bin
+    MNRatio_start = float(peak_MNRatio - peak_width / 2.0)
+    MNRatio_end = float(peak_MNRatio + peak_width / 2.0)
+    num_bins = int(reciprocal_bins * (MNRatio_end - MNRatio_start))
+    bins = np.linspace(MNRatio_start, MNRatio_end, num_bins)
+    if len(bins) < 2:
+        return np.zeros(0), np.zeros(0), np.zeros(0, dtype=np.int64)
+    freq = spectrum.sorted_histogram(sorted_values, bins)
+
+    decimals = np.log10(reciprocal_bins)
+    bins = np.floor(bins * 10 ** decimals) / 10 ** decimals
+    return bins[:-1], bins[:-1] + cutoff_bin, freq
+
+
+def segment_peaks(bin_lower, bin_upper, freq, cutoff_height, cutoff_width):
+    """
+    Peaks of a window histogram: runs of bins higher than cutoff_height that are longer than cutoff_width bins
+    :param bin_lower: numpy.array of lower bin edges
+    :param bin_upper: numpy.array of upper bin edges
+    :param freq: numpy.array of counts per bin
+    :param cutoff_height: minimum count of a peak bin
+    :param cutoff_width: minimum number of bins of a peak
+    :return: dict of numpy.arrays per peak with keys low, high (MN_Ratio interval) and run (bins)
+    """
+    if len(freq) == 0:
+        return {'low': np.zeros(0), 'high': np.zeros(0), 'run': np.zeros(0, dtype=np.int64)}
+    # run boundaries of the height mask, the length of its run for every bin
+    height_status = freq > cutoff_height
+    subgroup = np.cumsum(np.concatenate(([True], height_status[1:] != height_status[:-1])))
+    subgroup_freq = np.bincount(subgroup)[subgroup]
+    peak_cutoff_status = (subgroup_freq > cutoff_width) & height_status
+    peak_cutoff_status[0] = False
+
+    previous = np.concatenate(([False], peak_cutoff_status[:-1]))
+    following = np.concatenate((peak_cutoff_status[1:], [False]))
+    first = np.flatnonzero(peak_cutoff_status & ~previous)
+    last = np.flatnonzero(peak_cutoff_status & ~following)
+    return {'low': bin_lower[first].astype(np.float64), 'high': bin_upper[last].astype(np.float64),
+            'run': subgroup_freq[first].astype(np.int64)}
+
+
+def classify_window(sorted_values, peak_MNRatio, peak_width, cutoff_bin, cutoff_height, cutoff_width):
+    """
+    Histogram of one range row window and its peaks
+    :param sorted_values: sorted MN_Ratio values, all of them or the slice inside the window
+    :param peak_MNRatio: center of the window
+    :param peak_width: width of the window
+    :param cutoff_bin: bin width
+    :param cutoff_height: minimum count of a peak bin
+    :param cutoff_width: minimum number of bins of a peak
+    :return: dict of numpy.arrays per peak of the window with keys low, high (MN_Ratio interval) and run (bins)
+    """
+    bin_lower, bin_upper, freq = window_histogram(sorted_values, peak_MNRatio, peak_width, cutoff_bin)
+    return segment_peaks(bin_lower, bin_upper, freq, cutoff_height, cutoff_width)
+
+
+def fixed_range(peak_MNRatio, peak_width):
+    """
+    Peak of a range row whose range is known (e.g. from a range file), no histogram or cutoffs are involved
+    :param peak_MNRatio: center of the range
+    :param peak_width: width of the range
+    :return: dict like classify_window with the single peak [center - width / 2, center + width / 2]
+    """
+    return {'low': np.array([peak_MNRatio - peak_width / 2.0]), 'high': np.array([peak_MNRatio + peak_width / 2.0]),
+            'run': np.zeros(1, dtype=np.int64)}
+
+
+def window_values(spectrum_index, peak_MNRatio, peak_width, *_cutoffs):
+    """
+    The sorted MN_Ratio values inside the window of a range row, a view that is cheap to send to a worker process
+    :param spectrum_index: dict from spectrum.build_spectrum_index
+    :param peak_MNRatio: center of the window
+    :param peak_width: width of the window
+    :return: numpy.array
+    """
+    low, high = spectrum.range_bounds(spectrum_index, peak_MNRatio - peak_width / 2.0,
+                                      peak_MNRatio + peak_width / 2.0)
+    return spectrum_index['sorted'][low:high]
+
+
+def worker_pool(n_jobs):
+    """
+    The persistent process pool of the range rows, it is only restarted when the number of workers changes
+    :param n_jobs: number of worker processes
+    :return: concurrent.futures.ProcessPoolExecutor
+    """
+    global _pool, _pool_jobs
+    if _pool is None or _pool_jobs != n_jobs:
+        shutdown_pool()
+        _pool = ProcessPoolExecutor(max_workers=n_jobs)
+        _pool_jobs = n_jobs
+    return _pool
+
+
+def shutdown_pool():
+    """
+    Stops the workers of the persistent pool, the next parallel call starts a new one
+    """
+    global _pool, _pool_jobs
+    if _pool is not None:
+        _pool.shutdown(wait=False)
+    _pool = None
+    _pool_jobs = 0
+
+
+def run_rows(function, tasks, n_jobs=None):
+    """
+    Maps function over the tasks of range rows in the persistent pool (in-process for n_jobs 1)
+    :param function: module level function of this module
+    :param tasks: iterable of argument tuples
+    :param n_jobs: number of worker processes (default ranging_jobs, None uses all but one core)
+    :return: list of results in the order of tasks
+    """
+    if n_jobs is None:
+        n_jobs = ranging_jobs if ranging_jobs is not None else spatial.default_workers()
+    if n_jobs <= 1:
+        return spatial.run_tasks(function, tasks, n_jobs=1)
+    try:
+        return spatial.run_tasks(function, tasks, n_jobs=n_jobs, executor=worker_pool(n_jobs))
+    except BrokenProcessPool:
+        # a worker died (e.g. out of memory), the next call starts a new pool
+        shutdown_pool()
+        raise
+
+
+def classify_rows(spectrum_index, rows, cache=None, n_jobs=None):
+    """
+    Classifies the windows of all range rows. With a cache, rows whose parameters did not change since the last call
+    on the same dataset are taken from it and only the changed rows are recomputed. The rows do not depend on each
+    other, so they are classified concurrently and only get their global peak numbers in number_peaks
+    :param spectrum_index: dict from spectrum.build_spectrum_index
+    :param rows: list of (peak_MNRatio, peak_width, cutoff_bin, cutoff_height, cutoff_width) tuples
+    :param cache: collections.OrderedDict shared between calls (None disables caching)
+    :param n_jobs: number of worker processes (default ranging_jobs, 1 runs in-process)
+    :return: list of dicts from classify_window
+    """
+    if n_jobs is None:
+        n_jobs = ranging_jobs
+    results = [None] * len(rows)
+    missing = []
+    for i, row in enumerate(rows):
+        key = (spectrum_index['digest'],) + tuple(row)
+        if cache is not None and key in cache:
+            cache.move_to_end(key)
+            results[i] = cache[key]
+        else:
+            missing.append(i)
+
+    if len(missing) < parallel_min_rows:
+        n_jobs = 1
+    tasks = ((window_values(spectrum_index, *rows[i]),) + tuple(rows[i]) for i in missing)
+    for i, result in zip(missing, run_rows(classify_window, tasks, n_jobs=n_jobs)):
+        results[i] = result
+        if cache is not None:
+            cache[(spectrum_index['digest'],) + tuple(rows[i])] = result
+            if len(cache) > range_cache_size:
+                cache.popitem(last=False)
+    return results
+
+
+def number_peaks(results):
+    """
+    Global peak numbers: the peaks of every row continue the numbering of the rows before it
+    :param results: list of dicts from classify_window
+    :return: numpy.arrays peak_no, low, high, run of all peaks
+    """
+    num_peaks = np.array([len(result['low']) for result in results], dtype=np.int64)
+    offsets = np.concatenate(([0], np.cumsum(num_peaks)[:-1]))
+    peak_no = np.concatenate([offset + np.arange(1, n + 1) for offset, n in zip(offsets, num_peaks)] +
+                             [np.zeros(0, dtype=np.int64)])
+    low = np.concatenate([result['low'] for result in results] + [np.zeros(0)])
+    high = np.concatenate([result['high'] for result in results] + [np.zeros(0)])
+    run = np.concatenate([result['run'] for result in results] + [np.zeros(0, dtype=np.int64)])
+    return peak_no, low, high, run
+
+
+def window_grid(spectrum_index, peak_MNRatio, peak_width, *_cutoffs):
+    """
+    The cumulative base grid counts of the spectrum index that cover the window of a range row, the fine histogram
+    that is shared by all candidates of the sweep
+    :param spectrum_index: dict from spectrum.build_spectrum_index
+    :param peak_MNRatio: center of the window
+    :param peak_width: width of the window
+    :return: (first, cumulative) with first the base grid index of cumulative[0]
+    """
+    base_bin = spectrum_index['base_bin']
+    cumulative = spectrum_index['cumulative']
+    first = min(len(cumulative) - 1, max(0, int(np.floor((peak_MNRatio - peak_width / 2.0) / base_bin))))
+    last = min(len(cumulative) - 1, max(first, int(np.ceil((peak_MNRatio + peak_width / 2.0) / base_bin)) + 1))
+    return first, cumulative[first:last + 1]
+
+
+def rebin_window(first, cumulative, base_bin, peak_MNRatio, peak_width, cutoff_bin):
+    """
+    Histogram of the window of a range row like window_histogram, re-binned from the cumulative base grid counts (the
+    bin edges are rounded to the base grid)
+    :param first: base grid index of cumulative[0]
+    :param cumulative: cumulative base grid counts from window_grid
+    :param base_bin: resolution of the base grid
+    :param peak_MNRatio: center of the window
+    :param peak_width: width of the window
+    :param cutoff_bin: bin width (not finer than base_bin)
+    :return: numpy.arrays bin_lower, bin_upper, freq (empty if the window is narrower than two bins)
+    """
+    reciprocal_bins = 1 / cutoff_bin
+    MNRatio_start = float(peak_MNRatio - peak_width / 2.0)
+    MNRatio_end = float(peak_MNRatio + peak_width / 2.0)
+    num_bins = int(reciprocal_bins * (MNRatio_end - MNRatio_start))
+    bins = np.linspace(MNRatio_start, MNRatio_end, num_bins)
+    if len(bins) < 2:
+        return np.zeros(0), np.zeros(0), np.zeros(0, dtype=np.int64)
+    grid_index = np.clip(np.rint(bins / base_bin).astype(np.int64) - first, 0, len(cumulative) - 1)
+    freq = np.diff(cumulative[grid_index]).astype(np.int64)
+
+    decimals = np.log10(reciprocal_bins)
+    bins = np.floor(bins * 10 ** decimals) / 10 ** decimals
+    return bins[:-1], bins[:-1] + cutoff_bin, freq
+
+
+def sweep_window(first, cumulative, base_bin, peak_MNRatio, peak_width, cutoff_bins, cutoff_heights, cutoff_widths):
+    """
+    Evaluates a grid of cutoff parameters on the window of one range row. The histogram of every bin width is
+    re-binned once from the shared base grid counts and used by all height/width candidates
+    :param first: base grid index of cumulative[0]
+    :param cumulative: cumulative base grid counts from window_grid
+    :param base_bin: resolution of the base grid
+    :param peak_MNRatio: center of the window
+    :param peak_width: width of the window
+    :param cutoff_bins: list of bin widths
+    :param cutoff_heights: list of cutoff heights
+    :param cutoff_widths: list of cutoff widths
+    :return: dict of numpy.arrays per candidate with keys cutoff_bin, cutoff_height, cutoff_width, num_peaks,
+    peak_low, peak_high (peak containing peak_MNRatio, nan if none), peak_count and total_count (ions in all peaks)
+    """
+    columns = {key: [] for key in ['cutoff_bin', 'cutoff_height', 'cutoff_width', 'num_peaks', 'peak_low',
+                                   'peak_high', 'peak_count', 'total_count']}
+    for cutoff_bin in cutoff_bins:
+        histogram = rebin_window(first, cumulative, base_bin, peak_MNRatio, peak_width, cutoff_bin)
+        for cutoff_height in cutoff_heights:
+            for cutoff_width in cutoff_widths:
+                peaks = segment_peaks(*histogram, cutoff_height, cutoff_width)
+                low = np.clip(np.rint(peaks['low'] / base_bin).astype(np.int64) - first, 0, len(cumulative) - 1)
+                high = np.clip(np.rint(peaks['high'] / base_bin).astype(np.int64) - first, 0, len(cumulative) - 1)
+                counts = cumulative[high] - cumulative[low]
+                # same rule as the matching of table rows to peaks in start_binning
+                inside = np.flatnonzero((peaks['low'] < peak_MNRatio) & (peak_MNRatio < peaks['high']))
+                columns['cutoff_bin'].append(cutoff_bin)
+                columns['cutoff_height'].append(cutoff_height)
+                columns['cutoff_width'].append(cutoff_width)
+                columns['num_peaks'].append(len(peaks['low']))
+                columns['peak_low'].append(peaks['low'][inside[0]] if len(inside) else np.nan)
+                columns['peak_high'].append(peaks['high'][inside[0]] if len(inside) else np.nan)
+                columns['peak_count'].append(counts[inside[0]] if len(inside) else 0)
+                columns['total_count'].append(counts.sum())
+    return {key: np.array(values) for key, values in columns.items()}
+
+
+def sweep_rows(spectrum_index, rows, cutoff_bins=None, height_factors=None, cutoff_widths=None, n_jobs=None):
+    """
+    Parameter sweep of all range rows against the shared spectrum index, the rows are evaluated concurrently. The
+    histograms are re-binned from the cumulative counts of the index, so no row touches the MN_Ratio values and the
+    bin edges are resolved to the base bin of the index
+    :param spectrum_index: dict from spectrum.build_spectrum_index
+    :param rows: list of (peak_MNRatio, peak_width, cutoff_bin, cutoff_height, cutoff_width) tuples, the cutoff
+    height of the row is scaled by height_factors
+    :param cutoff_bins: bin widths to try, not finer than the base bin of the index (default sweep_bins)
+    :param height_factors: factors of the cutoff height of the row to try (default sweep_height_factors)
+    :param cutoff_widths: cutoff widths to try (default sweep_widths)
+    :param n_jobs: number of worker processes (default ranging_jobs)
+    :return: dict of numpy.arrays per row and candidate, keys of sweep_window plus row and peak_MNRatio
+    """
+    if cutoff_bins is None:
+        cutoff_bins = sweep_bins
+    if height_factors is None:
+        height_factors = sweep_height_factors
+    if cutoff_widths is None:
+        cutoff_widths = sweep_widths
+    if n_jobs is None:
+        n_jobs = ranging_jobs
+    if len(rows) < parallel_min_rows:
+        n_jobs = 1
+    base_bin = spectrum_index['base_bin']
+    if min(cutoff_bins) < base_bin * (1 - 1e-9):
+        raise ValueError("cutoff bins finer than the base bin (%g) of the spectrum index" % base_bin)
+
+    tasks = (window_grid(spectrum_index, *row) + (base_bin, row[0], row[1], cutoff_bins,
+             sorted(set(int(round(row[3] * factor)) for factor in height_factors)), cutoff_widths) for row in rows)
+    results = run_rows(sweep_window, tasks, n_jobs=n_jobs)
+    sweep = {'row': np.concatenate([np.full(len(result['num_peaks']), i) for i, result in enumerate(results)]),
+             'peak_MNRatio': np.concatenate([np.full(len(result['num_peaks']), row[0])
+                                             for row, result in zip(rows, results)])}
+    for key in results[0]:
+        sweep[key] = np.concatenate([result[key] for result in results])
+    return sweep
+
+
+def _composition(tokens):
+    # element:count tokens of a range line, other keys (vol, color, name) are skipped
+    composition = []
+    for token in tokens:
+        key, _, value = token.partition(':')
+        if key.lower() in ('vol', 'color', 'name') or not re.match(r'^[A-Z][a-z]?$', key):
+            continue
+        count = int(float(value)) if value else 1
+        if count > 0:
+            composition.append((key, count))
+    return tuple(composition)
+
+
+def read_rrng(path):
+    """
+    Reads an IVAS .rrng range file
+    :param path: file path
+    :return: dict with keys low, high (numpy.arrays) and composition (list of ((symbol, count), ...) per range)
+    """
+    low, high, composition = [], [], []
+    section = None
+    with open(path, 'r') as fileInput:
+        for line in fileInput:
+            line = line.strip()
+            if line.startswith('[') and line.endswith(']'):
+                section = line[1:-1].lower()
+            elif section == 'ranges' and line.lower().startswith('range') and '=' in line:
+                tokens = line.split('=', 1)[1].split()
+                low.append(float(tokens[0]))
+                high.append(float(tokens[1]))
+                composition.append(_composition(tokens[2:]))
+    return {'low': np.array(low, dtype=np.float64), 'high': np.array(high, dtype=np.float64),
+            'composition': composition}
+
+
+def read_rng(path):
+    """
+    Reads an Oak Ridge .rng range file (ion names, a dashed header naming the columns and one line per range with the
+    count of every column)
+    :param path: file path
+    :return: dict with keys low, high (numpy.arrays) and composition (list of ((symbol, count), ...) per range)
+    """
+    with open(path, 'r') as fileInput:
+        lines = [line.strip() for line in fileInput if line.strip()]
+    num_ions, num_ranges = (int(value) for value in lines[0].split()[:2])
+    header = next(i for i, line in enumerate(lines) if line.startswith('-'))
+    columns = lines[header].lstrip('-').split()
+    low, high, composition = [], [], []
+    for line in lines[header + 1:header + 1 + num_ranges]:
+        tokens = line.split()
+        if tokens[0] == '.':
+            tokens = tokens[1:]
+        low.append(float(tokens[0]))
+        high.append(float(tokens[1]))
+        counts = [int(float(value)) for value in tokens[2:2 + len(columns)]]
+        composition.append(_composition(["%s:%d" % (column, count) for column, count in zip(columns, counts)]))
+    return {'low': np.array(low, dtype=np.float64), 'high': np.array(high, dtype=np.float64),
+            'composition': composition}
+
+
+def write_rrng(path, ranges):
+    """
+    Writes ranges as IVAS .rrng file
+    :param path: file path
+    :param ranges: dict with keys low, high and composition like read_rrng
+    """
+    symbols = list(dict.fromkeys(symbol for composition in ranges['composition'] for symbol, _ in composition))
+    names = list(dict.fromkeys(ranges['composition']))
+    with open(path, 'w') as fileOutput:
+        fileOutput.write("[Ions]\nNumber=%d\n" % len(symbols))
+        for i, symbol in enumerate(symbols):
+            fileOutput.write("Ion%d=%s\n" % (i + 1, symbol))
+        fileOutput.write("[Ranges]\nNumber=%d\n" % len(ranges['low']))
+        for i, (low, high, composition) in enumerate(zip(ranges['low'], ranges['high'], ranges['composition'])):
+            text = " ".join("%s:%d" % (symbol, count) for symbol, count in composition)
+            color = range_colors[names.index(composition) % len(range_colors)]
+            fileOutput.write("Range%d=%.4f %.4f vol:0.00000 %s color:%s\n" % (i + 1, low, high, text, color))
+
+
+def write_rng(path, ranges):
+    """
+    Writes ranges as Oak Ridge .rng file, the columns are the elements of all ranges
+    :param path: file path
+    :param ranges: dict with keys low, high and composition like read_rng
+    """
+    symbols = list(dict.fromkeys(symbol for composition in ranges['composition'] for symbol, _ in composition))
+    with open(path, 'w') as fileOutput:
+        fileOutput.write("%d %d\n" % (len(symbols), len(ranges['low'])))
+        for i, symbol in enumerate(symbols):
+            color = range_colors[i % len(range_colors)]
+            rgb = " ".join("%.3f" % (int(color[j:j + 2], 16) / 255) for j in (0, 2, 4))
+            fileOutput.write("%s\n%s %s\n" % (symbol, symbol, rgb))
+        fileOutput.write("-------------------- %s\n" % " ".join(symbols))
+        for low, high, composition in zip(ranges['low'], ranges['high'], ranges['composition']):
+            counts = dict(composition)
+            fileOutput.write(". %.4f %.4f %s\n" % (low, high, " ".join(str(counts.get(symbol, 0))
+                                                                         for symbol in symbols)))
+
+
+def read_range_file(path):
+    """
+    Reads a .rng or .rrng range file (by extension)
+    :param path: file path
+    :return: dict with keys low, high and composition
+    """
+    if os.path.splitext(path)[1].lower() == '.rrng':
+        return read_rrng(path)
+    return read_rng(path)
+
+
+def write_range_file(path, ranges):
+    """
+    Writes a .rng or .rrng range file (by extension)
+    :param path: file path
+    :param ranges: dict with keys low, high and composition
+    """
+    if os.path.splitext(path)[1].lower() == '.rrng':
+        write_rrng(path, ranges)
+    else:
+        write_rng(path, ranges)
+
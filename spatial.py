@@ -0,0 +1,600 @@
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+from scipy import ndimage
+from scipy.signal import fftconvolve
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial import ConvexHull, cKDTree
+from skimage.measure import marching_cubes
+
+# Number of ions a single DBSCAN tile should own. Together with the eps-wide halo this bounds the memory per worker
+dbscan_tile_size = 200000
+# Maximum number of (ion, hull facet) distances evaluated at once during point-in-hull classification
+hull_chunk_elements = 20000000
+# Number of ions binned or interpolated at once on the isoconcentration voxel grid
+voxel_chunk_size = 5000000
+# Number of ions per chunk and number of nearest triangle centroids tested for the distance to an interface mesh
+proxigram_chunk_size = 1000000
+proxigram_candidates = 8
+
+
+def default_workers():
+    """
+    Number of worker processes used by the parallel spatial routines
+    :return: int
+    """
+    return max(1, (os.cpu_count() or 1) - 1)
+
+
+def run_tasks(function, tasks, n_jobs=None, threads=False, executor=None):
+    """
+    Maps a module level function over argument tuples, either in-process or in a worker pool. Tasks may be given as a
+    generator and are only created while at most two per worker are in flight, so the memory stays bounded
+    :param function: function taking the unpacked argument tuple (must be picklable for processes)
+    :param tasks: iterable of argument tuples
+    :param n_jobs: number of workers (None uses all but one core, 1 runs in-process)
+    :param threads: use a thread pool instead of a process pool (for numpy work that releases the GIL)
+    :param executor: running pool with n_jobs workers to use instead of starting a new one (it is not shut down)
+    :return: list of results in the order of tasks
+    """
+    if n_jobs is None:
+        n_jobs = default_workers()
+    if n_jobs <= 1:
+        return [function(*task) for task in tasks]
+    if executor is None:
+        executor_class = ThreadPoolExecutor if threads else ProcessPoolExecutor
+        with executor_class(max_workers=n_jobs) as executor:
+            return run_tasks(function, tasks, n_jobs, executor=executor)
+
+    results = []
+    pending = deque()
+    for task in tasks:
+        pending.append(executor.submit(function, *task))
+        if len(pending) >= 2 * n_jobs:
+            results.append(pending.popleft().result())
+    while pending:
+        results.append(pending.popleft().result())
+    return results
+
+
+def union_find(num_nodes, node_a, node_b):
+    """
+    Array based union-find. Every pair (node_a[i], node_b[i]) is merged and each node ends up pointing to the smallest
+    node index of its connected set, so the roots can directly be used to order the sets
+    :param num_nodes: total number of nodes
+    :param node_a: numpy.array of node indices
+    :param node_b: numpy.array of node indices (same length as node_a)
+    :return: numpy.array of root indices for every node
+    """
+    parent = np.arange(num_nodes)
+    node_a = np.asarray(node_a, dtype=np.int64)
+    node_b = np.asarray(node_b, dtype=np.int64)
+
+    while True:
+        root_a = parent[node_a]
+        root_b = parent[node_b]
+        hook = root_a != root_b
+        if not hook.any():
+            break
+        # hook the larger root under the smaller one, then compress all paths by pointer jumping
+        np.minimum.at(parent, np.maximum(root_a[hook], root_b[hook]), np.minimum(root_a[hook], root_b[hook]))
+        while True:
+            grand_parent = parent[parent]
+            if np.array_equal(grand_parent, parent):
+                break
+            parent = grand_parent
+
+    return parent
+
+
+def make_tiles(points, eps, tile_size=None):
+    """
+    Partitions the point cloud into a grid of blocks holding roughly tile_size points each. Every point is owned by
+    exactly one tile and is additionally shared as halo with all other tiles whose block lies within eps of it
+    :param points: numpy.array of shape (N, 3)
+    :param eps: width of the halo
+    :param tile_size: approximate number of owned points per tile
+    :return: list of (region_idx, owned) tuples, region_idx being the global indices of owned + halo points and
+             owned a boolean mask over region_idx
+    """
+    if tile_size is None:
+        tile_size = dbscan_tile_size
+    num_points = points.shape[0]
+    tiles_per_axis = max(1, int(np.ceil((num_points / float(tile_size)) ** (1 / 3.0))))
+
+    # inner edges along each axis are taken at quantiles so that the tiles stay balanced for non uniform clouds
+    quantiles = np.linspace(0, 1, tiles_per_axis + 1)[1:-1]
+    edges = [np.unique(np.quantile(points[:, axis], quantiles)) for axis in range(3)]
+    shape = [len(edge) + 1 for edge in edges]
+
+    owner = np.ravel_multi_index([np.searchsorted(edges[axis], points[:, axis], side='right') for axis in range(3)],
+                                 shape)
+    low = [np.searchsorted(edges[axis], points[:, axis] - eps, side='right') for axis in range(3)]
+    high = [np.searchsorted(edges[axis], points[:, axis] + eps, side='right') for axis in range(3)]
+    span = [int((high[axis] - low[axis]).max()) + 1 for axis in range(3)]
+
+    member_idx = []
+    member_tile = []
+    for dx in range(span[0]):
+        for dy in range(span[1]):
+            for dz in range(span[2]):
+                cell = [low[0] + dx, low[1] + dy, low[2] + dz]
+                inside = (cell[0] <= high[0]) & (cell[1] <= high[1]) & (cell[2] <= high[2])
+                member_idx.append(np.flatnonzero(inside))
+                member_tile.append(np.ravel_multi_index([c[inside] for c in cell], shape))
+
+    member_idx = np.concatenate(member_idx)
+    member_tile = np.concatenate(member_tile)
+    order = np.lexsort((member_idx, member_tile))
+    member_idx = member_idx[order]
+    member_tile = member_tile[order]
+    bounds = np.flatnonzero(np.diff(member_tile)) + 1
+
+    tiles = []
+    for region_idx, region_tile in zip(np.split(member_idx, bounds), np.split(member_tile, bounds)):
+        owned = owner[region_idx] == region_tile[0]
+        if owned.any():
+            tiles.append((region_idx, owned))
+    return tiles
+
+
+def _dbscan_tile_core(region_points, owned, eps, min_samples):
+    # core status of the owned points is exact since all their eps neighbours are inside the region
+    tree = cKDTree(region_points)
+    counts = tree.query_ball_point(region_points[owned], eps, return_length=True)
+    return counts >= min_samples
+
+
+def _dbscan_tile_links(region_points, region_idx, owned, region_core, eps):
+    core_idx = region_idx[region_core]
+    core_points = region_points[region_core]
+    if len(core_idx) == 0:
+        return core_idx, core_idx, np.empty((0, 2), dtype=np.int64)
+    core_tree = cKDTree(core_points)
+
+    # local clusters between all core points of the region, each represented by its smallest global index
+    pairs = core_tree.query_pairs(eps, output_type='ndarray')
+    graph = coo_matrix((np.ones(len(pairs), dtype=bool), (pairs[:, 0], pairs[:, 1])),
+                       shape=(len(core_idx), len(core_idx)))
+    _, local_label = connected_components(graph, directed=False)
+    representative = np.full(local_label.max() + 1, np.iinfo(np.int64).max)
+    np.minimum.at(representative, local_label, core_idx)
+    core_link = representative[local_label]
+
+    # border points are the owned non-core points within eps of at least one core point
+    border = owned & ~region_core
+    border_idx = region_idx[border]
+    neighbours = core_tree.query_ball_point(region_points[border], eps)
+    lengths = np.fromiter(map(len, neighbours), dtype=np.int64, count=len(neighbours))
+    if lengths.sum() > 0:
+        flat = np.concatenate([np.asarray(n, dtype=np.int64) for n in neighbours if len(n)])
+        border_pairs = np.unique(np.column_stack([np.repeat(border_idx, lengths), core_link[flat]]), axis=0)
+    else:
+        border_pairs = np.empty((0, 2), dtype=np.int64)
+
+    return core_idx, core_link, border_pairs
+
+
+def tiled_dbscan(points, eps, min_samples, tile_size=None, n_jobs=None):
+    """
+    DBSCAN over blocks of the point cloud with eps-wide halos, run in a process pool. Local clusters of the tiles are
+    stitched together with a union-find on the shared halo points. The labels are identical to
+    sklearn.cluster.DBSCAN(eps, min_samples).fit(points).labels_ including the numbering and the border point rule
+    (a border point reachable from several clusters takes the one that is found first)
+    :param points: numpy.array of shape (N, 3)
+    :param eps: neighbourhood radius
+    :param min_samples: number of points (including the point itself) in the neighbourhood of a core point
+    :param tile_size: approximate number of points owned by a single tile
+    :param n_jobs: number of worker processes
+    :return: numpy.array of cluster labels, -1 for noise
+    """
+    points = np.ascontiguousarray(points, dtype=np.float64)
+    num_points = points.shape[0]
+    labels = np.full(num_points, -1, dtype=np.int64)
+    if num_points == 0:
+        return labels
+
+    tiles = make_tiles(points, eps, tile_size)
+
+    # pass 1: exact core status of the owned points of each tile
+    core_results = run_tasks(_dbscan_tile_core,
+                             ((points[region_idx], owned, eps, min_samples) for region_idx, owned in tiles), n_jobs)
+    is_core = np.zeros(num_points, dtype=bool)
+    for (region_idx, owned), tile_core in zip(tiles, core_results):
+        is_core[region_idx[owned]] = tile_core
+    del core_results
+
+    # pass 2: local clusters and border candidates, using the global core status of the halo points
+    link_results = run_tasks(_dbscan_tile_links,
+                             ((points[region_idx], region_idx, owned, is_core[region_idx], eps)
+                              for region_idx, owned in tiles), n_jobs)
+
+    node_a = np.concatenate([result[0] for result in link_results])
+    node_b = np.concatenate([result[1] for result in link_results])
+    border_pairs = np.concatenate([result[2] for result in link_results])
+    del link_results
+
+    root = union_find(num_points, node_a, node_b)
+
+    # clusters are numbered by their smallest core point index which is the root of the union-find
+    core_roots, core_label = np.unique(root[is_core], return_inverse=True)
+    labels[is_core] = core_label
+    if len(border_pairs):
+        border_label = np.searchsorted(core_roots, root[border_pairs[:, 1]])
+        best = np.full(num_points, np.iinfo(np.int64).max)
+        np.minimum.at(best, border_pairs[:, 0], border_label)
+        border = best != np.iinfo(np.int64).max
+        labels[border] = best[border]
+
+    return labels
+
+
+def _points_in_hull_chunk(x, y, z, equations, low, high, tolerance):
+    # cheap bounding box prefilter, only the remaining candidates are tested against the facet planes
+    inside = (x >= low[0]) & (x <= high[0]) & (y >= low[1]) & (y <= high[1]) & (z >= low[2]) & (z <= high[2])
+    candidates = np.flatnonzero(inside)
+    if len(candidates):
+        points = np.column_stack((x[candidates], y[candidates], z[candidates]))
+        # a point is inside when it lies on the inner side of every facet: normal . point + offset <= 0
+        distance = points @ equations[:, :3].T
+        distance += equations[:, 3]
+        inside[candidates] = (distance <= tolerance).all(axis=1)
+    return inside
+
+
+def points_in_hull(hull, x, y, z, n_jobs=None):
+    """
+    Classifies points as inside or outside a convex hull using the half-space equations of its facets. The points
+    are streamed in chunks sized by the number of facets and the chunks are processed in a thread pool
+    :param hull: scipy.spatial.ConvexHull
+    :param x: numpy.array of X coordinates
+    :param y: numpy.array of Y coordinates
+    :param z: numpy.array of Z coordinates
+    :param n_jobs: number of worker threads
+    :return: numpy.array of bool, True for points inside or on the hull
+    """
+    x, y, z = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64), np.asarray(z, dtype=np.float64)
+    equations = hull.equations
+    vertices = hull.points[hull.vertices]
+    low, high = vertices.min(axis=0), vertices.max(axis=0)
+    tolerance = 1e-10 * max(float((high - low).max()), 1.0)
+    low, high = low - tolerance, high + tolerance
+
+    chunk = max(1, hull_chunk_elements // len(equations))
+    starts = range(0, len(x), chunk)
+    results = run_tasks(_points_in_hull_chunk,
+                        ((x[s:s + chunk], y[s:s + chunk], z[s:s + chunk], equations, low, high, tolerance)
+                         for s in starts), n_jobs, threads=True)
+    if not results:
+        return np.zeros(0, dtype=bool)
+    return np.concatenate(results)
+
+
+def _cluster_hull(label, points):
+    # degenerate clusters (too few or coplanar points) have no volume and therefore no hull
+    if points.shape[0] < 4:
+        return None
+    try:
+        hull = ConvexHull(points)
+    except (RuntimeError, ValueError):
+        return None
+    vertices = hull.vertices
+    remap = np.full(points.shape[0], -1, dtype=np.int64)
+    remap[vertices] = np.arange(len(vertices))
+    return {'label': label, 'equations': hull.equations, 'vertices': points[vertices],
+            'simplices': remap[hull.simplices], 'low': points[vertices].min(axis=0),
+            'high': points[vertices].max(axis=0)}
+
+
+def cluster_hulls(points, labels, n_jobs=None):
+    """
+    Builds one convex hull per cluster label in a process pool. Noise (label -1) is ignored
+    :param points: numpy.array of shape (N, 3)
+    :param labels: numpy.array of N cluster labels (e.g. from DBSCAN)
+    :param n_jobs: number of worker processes
+    :return: list of dict with the keys label, equations, vertices, simplices (indices into vertices), low and high
+             (bounding box), sorted by label. Clusters without volume are skipped
+    """
+    points = np.asarray(points, dtype=np.float64)
+    labels = np.asarray(labels)
+    keep = labels != -1
+    points, labels = points[keep], labels[keep]
+    order = np.argsort(labels, kind='stable')
+    points, labels = points[order], labels[order]
+    bounds = np.flatnonzero(np.diff(labels)) + 1
+
+    groups = zip(np.split(labels, bounds), np.split(points, bounds))
+    hulls = run_tasks(_cluster_hull, ((group_labels[0], group_points) for group_labels, group_points in groups
+                                      if len(group_labels)), n_jobs)
+    return [hull for hull in hulls if hull is not None]
+
+
+def _hull_grid(hulls):
+    # uniform grid over the hull bounding boxes, every cell lists the hulls whose box overlaps it (CSR layout)
+    lows = np.array([hull['low'] for hull in hulls])
+    highs = np.array([hull['high'] for hull in hulls])
+    origin = lows.min(axis=0)
+    cell = max(float(np.median((highs - lows).max(axis=1))), 1e-9)
+    shape = (np.floor((highs.max(axis=0) - origin) / cell).astype(np.int64) + 1)
+
+    first = np.floor((lows - origin) / cell).astype(np.int64)
+    last = np.floor((highs - origin) / cell).astype(np.int64)
+    cell_keys = []
+    cell_hulls = []
+    for hull_no in range(len(hulls)):
+        ranges = [np.arange(first[hull_no, axis], last[hull_no, axis] + 1) for axis in range(3)]
+        cells = np.stack(np.meshgrid(*ranges, indexing='ij'), axis=-1).reshape(-1, 3)
+        cell_keys.append(np.ravel_multi_index(cells.T, shape))
+        cell_hulls.append(np.full(len(cells), hull_no, dtype=np.int64))
+
+    cell_keys = np.concatenate(cell_keys)
+    cell_hulls = np.concatenate(cell_hulls)
+    order = np.lexsort((cell_hulls, cell_keys))
+    cell_keys, cell_hulls = cell_keys[order], cell_hulls[order]
+    keys, starts = np.unique(cell_keys, return_index=True)
+    starts = np.append(starts, len(cell_keys))
+    return {'origin': origin, 'cell': cell, 'shape': shape, 'keys': keys, 'starts': starts, 'hulls': cell_hulls,
+            'lows': lows, 'highs': highs}
+
+
+def _cluster_hull_chunk(x, y, z, grid, hulls, tolerance):
+    result = np.full(len(x), -1, dtype=np.int64)
+    points = np.column_stack((x, y, z))
+    cells = np.floor((points - grid['origin']) / grid['cell']).astype(np.int64)
+    on_grid = np.flatnonzero(((cells >= 0) & (cells < grid['shape'])).all(axis=1))
+    keys = np.ravel_multi_index(cells[on_grid].T, grid['shape'])
+    pos = np.searchsorted(grid['keys'], keys)
+    pos[pos == len(grid['keys'])] = 0
+    found = grid['keys'][pos] == keys
+    on_grid, pos = on_grid[found], pos[found]
+
+    # expand every point into (point, candidate hull) pairs from the cell lists
+    counts = grid['starts'][pos + 1] - grid['starts'][pos]
+    pair_point = np.repeat(on_grid, counts)
+    offsets = np.repeat(grid['starts'][pos] - (np.cumsum(counts) - counts), counts)
+    pair_hull = grid['hulls'][offsets + np.arange(counts.sum())]
+
+    in_box = ((points[pair_point] >= grid['lows'][pair_hull] - tolerance) &
+              (points[pair_point] <= grid['highs'][pair_hull] + tolerance)).all(axis=1)
+    pair_point, pair_hull = pair_point[in_box], pair_hull[in_box]
+
+    order = np.argsort(pair_hull, kind='stable')
+    pair_point, pair_hull = pair_point[order], pair_hull[order]
+    hull_ids, hull_starts = np.unique(pair_hull, return_index=True)
+    for hull_no, candidates in zip(hull_ids, np.split(pair_point, hull_starts[1:])):
+        equations = hulls[hull_no]['equations']
+        distance = points[candidates] @ equations[:, :3].T
+        distance += equations[:, 3]
+        inside = candidates[(distance <= tolerance).all(axis=1)]
+        # overlapping hulls: the ion is assigned to the smallest cluster label
+        label = hulls[hull_no]['label']
+        result[inside] = np.where(result[inside] == -1, label, np.minimum(result[inside], label))
+    return result
+
+
+def points_in_cluster_hulls(hulls, x, y, z, n_jobs=None):
+    """
+    Finds the cluster hull containing every point. Candidate hulls come from a grid index of the hull bounding boxes,
+    then only those hulls are tested with their facet equations. The points are processed in chunks on a thread pool
+    :param hulls: list of hulls as returned by cluster_hulls
+    :param x: numpy.array of X coordinates
+    :param y: numpy.array of Y coordinates
+    :param z: numpy.array of Z coordinates
+    :param n_jobs: number of worker threads
+    :return: numpy.array with the cluster label of the enclosing hull, -1 for points outside all hulls
+    """
+    x, y, z = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64), np.asarray(z, dtype=np.float64)
+    if not hulls or len(x) == 0:
+        return np.full(len(x), -1, dtype=np.int64)
+
+    grid = _hull_grid(hulls)
+    tolerance = 1e-10 * max(float((grid['highs'].max(axis=0) - grid['origin']).max()), 1.0)
+    max_facets = max(len(hull['equations']) for hull in hulls)
+    chunk = max(1, hull_chunk_elements // max_facets)
+    results = run_tasks(_cluster_hull_chunk,
+                        ((x[s:s + chunk], y[s:s + chunk], z[s:s + chunk], grid, hulls, tolerance)
+                         for s in range(0, len(x), chunk)), n_jobs, threads=True)
+    return np.concatenate(results)
+
+
+def _voxel_index(x, y, z, origin, voxel_size, shape):
+    idx = [np.clip(((c - o) // voxel_size).astype(np.int64), 0, n - 1) for c, o, n in zip((x, y, z), origin, shape)]
+    return np.ravel_multi_index(idx, shape)
+
+
+def concentration_grid(x, y, z, is_solute, voxel_size, sigma=1.0, method='gaussian'):
+    """
+    Bins the ions into cubic voxels and delocalizes the counts with a Gaussian kernel, either as a separable filter
+    or as an FFT convolution. The concentration is the ratio of the smoothed solute and total counts
+    :param x: numpy.array of X coordinates
+    :param y: numpy.array of Y coordinates
+    :param z: numpy.array of Z coordinates
+    :param is_solute: numpy.array of bool, True for the ions counted as solute
+    :param voxel_size: edge length of the voxels
+    :param sigma: standard deviation of the delocalization kernel in voxels (0 disables it)
+    :param method: 'gaussian' (separable filter) or 'fft' (FFT convolution)
+    :return: dict with origin, voxel_size, shape, concentration (numpy.array) and total (smoothed counts)
+    """
+    origin = np.array([np.min(x), np.min(y), np.min(z)], dtype=np.float64)
+    extent = np.array([np.max(x), np.max(y), np.max(z)], dtype=np.float64) - origin
+    shape = tuple(int(n) for n in np.floor(extent / voxel_size).astype(np.int64) + 1)
+    size = int(np.prod(shape))
+
+    total = np.zeros(size)
+    solute = np.zeros(size)
+    for s in range(0, len(x), voxel_chunk_size):
+        flat = _voxel_index(x[s:s + voxel_chunk_size], y[s:s + voxel_chunk_size], z[s:s + voxel_chunk_size],
+                            origin, voxel_size, shape)
+        total += np.bincount(flat, minlength=size)
+        solute += np.bincount(flat, weights=is_solute[s:s + voxel_chunk_size], minlength=size)
+    total = total.reshape(shape)
+    solute = solute.reshape(shape)
+
+    if sigma > 0:
+        if method == 'fft':
+            radius = int(np.ceil(4 * sigma))
+            axis = np.arange(-radius, radius + 1)
+            kernel_1d = np.exp(-0.5 * (axis / sigma) ** 2)
+            kernel_1d /= kernel_1d.sum()
+            kernel = kernel_1d[:, None, None] * kernel_1d[None, :, None] * kernel_1d[None, None, :]
+            total = fftconvolve(total, kernel, mode='same')
+            solute = fftconvolve(solute, kernel, mode='same')
+        else:
+            total = ndimage.gaussian_filter(total, sigma, mode='constant')
+            solute = ndimage.gaussian_filter(solute, sigma, mode='constant')
+
+    concentration = np.zeros(shape)
+    occupied = total > 1e-9
+    concentration[occupied] = np.clip(solute[occupied] / total[occupied], 0, 1)
+    return {'origin': origin, 'voxel_size': voxel_size, 'shape': shape, 'concentration': concentration,
+            'total': total}
+
+
+def isosurface(grid, threshold):
+    """
+    Extracts the isoconcentration surface from a concentration grid with marching cubes
+    :param grid: dict as returned by concentration_grid
+    :param threshold: concentration (fraction between 0 and 1) of the surface
+    :return: (vertices, faces) with vertices in sample coordinates, or (None, None) if the threshold is not crossed
+    """
+    concentration = grid['concentration']
+    if min(concentration.shape) < 2 or not concentration.min() < threshold < concentration.max():
+        return None, None
+    vertices, faces, _, _ = marching_cubes(concentration, level=threshold, spacing=(grid['voxel_size'],) * 3)
+    # grid values are sampled at the voxel centres
+    vertices = vertices + grid['origin'] + grid['voxel_size'] / 2.0
+    return vertices, faces
+
+
+def voxel_concentration(grid, x, y, z):
+    """
+    Looks up the concentration at every ion by trilinear interpolation between the voxel centres, O(N) and chunked
+    :param grid: dict as returned by concentration_grid
+    :param x: numpy.array of X coordinates
+    :param y: numpy.array of Y coordinates
+    :param z: numpy.array of Z coordinates
+    :return: numpy.array of concentrations
+    """
+    result = np.empty(len(x))
+    for s in range(0, len(x), voxel_chunk_size):
+        coords = [(np.asarray(c[s:s + voxel_chunk_size], dtype=np.float64) - o) / grid['voxel_size'] - 0.5
+                  for c, o in zip((x, y, z), grid['origin'])]
+        result[s:s + voxel_chunk_size] = ndimage.map_coordinates(grid['concentration'], coords, order=1,
+                                                                 mode='nearest')
+    return result
+
+
+def _closest_point_on_triangles(p, a, b, c):
+    # vectorized closest point on triangle (Ericson, Real-Time Collision Detection 5.1.5). The Voronoi regions are
+    # applied from the lowest to the highest precedence so that the last matching assignment wins
+    def dot(u, v):
+        return np.einsum('ij,ij->i', u, v)
+
+    ab, ac = b - a, c - a
+    ap, bp, cp = p - a, p - b, p - c
+    d1, d2 = dot(ab, ap), dot(ac, ap)
+    d3, d4 = dot(ab, bp), dot(ac, bp)
+    d5, d6 = dot(ab, cp), dot(ac, cp)
+    va = d3 * d6 - d5 * d4
+    vb = d5 * d2 - d1 * d6
+    vc = d1 * d4 - d3 * d2
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        denominator = va + vb + vc
+        denominator[denominator == 0] = 1.0
+        closest = a + ab * (vb / denominator)[:, None] + ac * (vc / denominator)[:, None]
+
+        region = (va <= 0) & (d4 - d3 >= 0) & (d5 - d6 >= 0)
+        weight = (d4 - d3) / ((d4 - d3) + (d5 - d6))
+        closest[region] = (b + (c - b) * weight[:, None])[region]
+
+        region = (vb <= 0) & (d2 >= 0) & (d6 <= 0)
+        weight = d2 / (d2 - d6)
+        closest[region] = (a + ac * weight[:, None])[region]
+
+        region = (d6 >= 0) & (d5 <= d6)
+        closest[region] = c[region]
+
+        region = (vc <= 0) & (d1 >= 0) & (d3 <= 0)
+        weight = d1 / (d1 - d3)
+        closest[region] = (a + ab * weight[:, None])[region]
+
+        region = (d3 >= 0) & (d4 <= d3)
+        closest[region] = b[region]
+
+        region = (d1 <= 0) & (d2 <= 0)
+        closest[region] = a[region]
+
+    return closest
+
+
+def _interface_distance(tree, triangles, x, y, z, upper_bound=np.inf):
+    points = np.column_stack((x, y, z))
+    k = min(proxigram_candidates, len(triangles))
+    _, candidates = tree.query(points, k=k, distance_upper_bound=upper_bound)
+    candidates = candidates.reshape(len(points), k)
+    distance = np.full(len(points), np.inf)
+
+    # candidates beyond the upper bound are reported with the index len(triangles)
+    near = np.flatnonzero(candidates[:, 0] < len(triangles))
+    candidates = candidates[near]
+    valid = candidates < len(triangles)
+    pair_points = np.repeat(points[near], k, axis=0)[valid.ravel()]
+    pair_triangles = triangles[candidates[valid]]
+    closest = _closest_point_on_triangles(pair_points, pair_triangles[:, 0], pair_triangles[:, 1],
+                                          pair_triangles[:, 2])
+    pair_distance = np.full(candidates.shape, np.inf)
+    pair_distance[valid] = np.sqrt(((pair_points - closest) ** 2).sum(axis=1))
+    distance[near] = pair_distance.min(axis=1)
+    return distance
+
+
+def interface_tree(vertices, faces):
+    """
+    Builds the spatial index of an interface mesh used for distance queries
+    :param vertices: numpy.array of shape (V, 3)
+    :param faces: numpy.array of shape (F, 3) with vertex indices of the triangles
+    :return: (cKDTree over the triangle centroids, numpy.array of triangle corners with shape (F, 3, 3))
+    """
+    triangles = np.asarray(vertices, dtype=np.float64)[np.asarray(faces)]
+    return cKDTree(triangles.mean(axis=1)), triangles
+
+
+def proxigram(vertices, faces, x, y, z, inside, species, num_species, bin_width, max_distance):
+    """
+    Proximity histogram: species counts binned by the signed distance to an interface. The ions are streamed in
+    chunks and only the (bins, species) count matrix is accumulated, so the memory does not grow with the dataset
+    :param vertices: numpy.array of shape (V, 3)
+    :param faces: numpy.array of shape (F, 3)
+    :param x: numpy.array of X coordinates
+    :param y: numpy.array of Y coordinates
+    :param z: numpy.array of Z coordinates
+    :param inside: numpy.array of bool, True for ions inside the feature
+    :param species: numpy.array of integer species codes (0 .. num_species - 1)
+    :param num_species: number of species
+    :param bin_width: width of the distance bins
+    :param max_distance: ions further than this from the interface (on either side) are ignored
+    :return: (bin_edges, counts) with counts of shape (num_bins, num_species)
+    """
+    num_bins = int(np.ceil(max_distance / bin_width))
+    edges = np.arange(-num_bins, num_bins + 1) * bin_width
+    counts = np.zeros((2 * num_bins, num_species), dtype=np.int64)
+    tree, triangles = interface_tree(vertices, faces)
+    # ions whose nearest centroid is further than this cannot be within max_distance of any triangle
+    radius = np.sqrt(((triangles - triangles.mean(axis=1)[:, None, :]) ** 2).sum(axis=2)).max()
+    upper_bound = num_bins * bin_width + radius
+
+    for s in range(0, len(x), proxigram_chunk_size):
+        e = s + proxigram_chunk_size
+        distance = _interface_distance(tree, triangles, x[s:e], y[s:e], z[s:e], upper_bound)
+        valid = np.isfinite(distance)
+        distance = np.where(inside[s:e], distance, -distance)
+        bins = np.floor(distance[valid] / bin_width).astype(np.int64) + num_bins
+        in_range = (bins >= 0) & (bins < 2 * num_bins)
+        flat = bins[in_range] * num_species + np.asarray(species[s:e])[valid][in_range]
+        counts += np.bincount(flat, minlength=counts.size).reshape(counts.shape)
+
+    return edges, counts
@@ -0,0 +1,313 @@
+import hashlib
+
+import numpy as np
+from scipy.optimize import nnls
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.signal import find_peaks, peak_prominences, peak_widths, savgol_filter
+
+# Resolution (Da) of the cumulative count table of the mass spectrum index. Histograms whose edges fall on this grid
+# are answered from the table without touching the ions
+spectrum_base_bin = 0.001
+# Maximum number of bins drawn by the level of detail spectrum view, about the pixel width of the plot
+spectrum_view_bins = 2000
+# Peak detection: Savitzky-Golay window (bins of the detection histogram), minimum prominence in counts per bin, height
+# above the background (fraction of the prominence) used as cutoff_height and the range width in units of the FWHM
+peak_smoothing_bins = 11
+peak_min_prominence = 10
+peak_cutoff_fraction = 0.1
+peak_range_fwhm = 4.0
+# Background model: bin width and half width of the averaging window, both in sqrt(MN_Ratio) units
+background_bin = 0.005
+background_window = 0.15
+
+
+def build_spectrum_index(mn_ratio, base_bin=None):
+    """
+    Builds the mass spectrum index of a dataset once: the sorted MN_Ratio values, the permutation that sorts them and
+    the cumulative counts on a fine base grid starting at 0
+    :param mn_ratio: numpy.array or pandas.Series of mass to charge ratios
+    :param base_bin: resolution of the cumulative count table (default spectrum_base_bin)
+    :return: dict with keys order, sorted, base_bin, cumulative, digest
+    """
+    if base_bin is None:
+        base_bin = spectrum_base_bin
+    values = np.asarray(mn_ratio, dtype=np.float64)
+    order = np.argsort(values, kind='stable')
+    sorted_values = values[order]
+
+    num_base_bins = int(np.ceil(sorted_values[-1] / base_bin)) + 1 if len(sorted_values) else 1
+    # cumulative[k] is the number of ions with MN_Ratio < k * base_bin
+    cumulative = np.searchsorted(sorted_values, np.arange(num_base_bins + 1) * base_bin, side='left')
+    # identifies the dataset in caches of results derived from the spectrum
+    digest = hashlib.blake2b(np.ascontiguousarray(sorted_values), digest_size=16).hexdigest()
+    return {'order': order, 'sorted': sorted_values, 'base_bin': base_bin, 'cumulative': cumulative,
+            'digest': digest}
+
+
+def range_bounds(spectrum, start, end):
+    """
+    Positions of a closed MN_Ratio range in the sorted values, O(log N)
+    :param spectrum: dict from build_spectrum_index
+    :param start: lower MN_Ratio (inclusive)
+    :param end: upper MN_Ratio (inclusive)
+    :return: (low, high) so that sorted[low:high] are the ions inside the range
+    """
+    low = np.searchsorted(spectrum['sorted'], start, side='left')
+    high = np.searchsorted(spectrum['sorted'], end, side='right')
+    return int(low), int(max(low, high))
+
+
+def sorted_histogram(sorted_values, edges):
+    """
+    Histogram of sorted values with the semantics of numpy.histogram, one binary search per edge
+    :param sorted_values: sorted numpy.array (all values or any slice of them that covers the edges)
+    :param edges: monotonically increasing bin edges
+    :return: numpy.array of counts (len(edges) - 1)
+    """
+    edges = np.asarray(edges, dtype=np.float64)
+    if len(edges) < 2:
+        return np.zeros(0, dtype=np.int64)
+    below = np.searchsorted(sorted_values, edges, side='left')
+    counts = np.diff(below)
+    counts[-1] += np.searchsorted(sorted_values, edges[-1], side='right') - below[-1]
+    return counts.astype(np.int64)
+
+
+def histogram(spectrum, edges):
+    """
+    Histogram of the indexed MN_Ratio values with the semantics of numpy.histogram (half open bins, the last one
+    closed). Edges on the base grid are looked up in the cumulative table in O(bins), any other edges cost a binary
+    search each
+    :param spectrum: dict from build_spectrum_index
+    :param edges: monotonically increasing bin edges
+    :return: numpy.array of counts (len(edges) - 1)
+    """
+    edges = np.asarray(edges, dtype=np.float64)
+    if len(edges) < 2:
+        return np.zeros(0, dtype=np.int64)
+    cumulative = spectrum['cumulative']
+    grid = edges / spectrum['base_bin']
+    grid_index = np.rint(grid).astype(np.int64)
+    on_grid = (np.all(grid_index >= 0) and np.all(grid_index < len(cumulative)) and
+               np.array_equal(grid_index * spectrum['base_bin'], edges))
+    if not on_grid:
+        return sorted_histogram(spectrum['sorted'], edges)
+    below = cumulative[grid_index]
+    counts = np.diff(below)
+    # the last bin includes its right edge
+    counts[-1] += np.searchsorted(spectrum['sorted'], edges[-1], side='right') - below[-1]
+    return counts.astype(np.int64)
+
+
+def histogram_pyramid(spectrum, bin_width, start=0.0, end=None):
+    """
+    Multi-resolution histogram: level 0 has the given bin width and every next level merges pairs of bins, until a
+    single bin covers the whole range
+    :param spectrum: dict from build_spectrum_index
+    :param bin_width: finest bin width
+    :param start: first edge
+    :param end: last MN_Ratio to cover (default maximum MN_Ratio)
+    :return: dict with keys start, bin_width, levels (list of numpy.array of counts)
+    """
+    if end is None:
+        end = float(spectrum['sorted'][-1])
+    num_bins = max(1, int(np.ceil((end - start) / bin_width)))
+    counts = histogram(spectrum, start + np.arange(num_bins + 1) * bin_width)
+    levels = [counts]
+    while len(counts) > 1:
+        if len(counts) % 2:
+            counts = np.append(counts, 0)
+        counts = counts.reshape(-1, 2).sum(axis=1)
+        levels.append(counts)
+    return {'start': start, 'bin_width': bin_width, 'levels': levels}
+
+
+def pyramid_view(pyramid, x_left, x_right, max_bins=None):
+    """
+    Picks the finest pyramid level that shows at most max_bins bins between x_left and x_right and returns that part
+    :param pyramid: dict from histogram_pyramid
+    :param x_left: left limit of the view
+    :param x_right: right limit of the view
+    :param max_bins: maximum number of bins to return (default spectrum_view_bins)
+    :return: (edges, counts, bin width of the chosen level)
+    """
+    if max_bins is None:
+        max_bins = spectrum_view_bins
+    start = pyramid['start']
+    for level, counts in enumerate(pyramid['levels']):
+        width = pyramid['bin_width'] * 2 ** level
+        if (x_right - x_left) / width <= max_bins:
+            break
+    first = int(np.clip(np.floor((x_left - start) / width), 0, len(counts)))
+    last = int(np.clip(np.ceil((x_right - start) / width), first, len(counts)))
+    edges = start + np.arange(first, last + 1) * width
+    return edges, counts[first:last], width
+
+
+def detect_peaks(spectrum, bin_width=None, start=0.0, end=None, prominence=None, max_peaks=None):
+    """
+    Finds the peaks of the full resolution spectrum (Savitzky-Golay smoothing and prominence based detection) and
+    proposes a range and cutoff values for each of them in the units of the input element table. The FWHM of all
+    peaks is estimated at once from the interpolated half prominence crossings
+    :param spectrum: dict from build_spectrum_index
+    :param bin_width: resolution of the detection histogram (default spectrum_base_bin)
+    :param start: first MN_Ratio to search
+    :param end: last MN_Ratio to search (default maximum MN_Ratio)
+    :param prominence: minimum prominence in counts per bin (default peak_min_prominence)
+    :param max_peaks: keep only the most prominent peaks (None keeps all)
+    :return: dict of numpy.arrays sorted by MN_Ratio with keys peak_MNRatio, fwhm, prominence, peak_width, cutoff_bin,
+    cutoff_height, cutoff_width
+    """
+    if bin_width is None:
+        bin_width = spectrum['base_bin']
+    if prominence is None:
+        prominence = peak_min_prominence
+    if end is None:
+        end = float(spectrum['sorted'][-1])
+    num_bins = max(1, int(np.ceil((end - start) / bin_width)))
+    counts = histogram(spectrum, start + np.arange(num_bins + 1) * bin_width)
+
+    window = min(peak_smoothing_bins, len(counts) - 1 + len(counts) % 2)
+    if window > 2:
+        smoothed = np.clip(savgol_filter(counts.astype(np.float64), window, 2), 0, None)
+    else:
+        smoothed = counts.astype(np.float64)
+    peaks, properties = find_peaks(smoothed, prominence=prominence)
+    if max_peaks is not None and len(peaks) > max_peaks:
+        keep = np.sort(np.argsort(properties['prominences'])[::-1][:max_peaks])
+        peaks = peaks[keep]
+    prominences, left_bases, right_bases = peak_prominences(smoothed, peaks)
+    fwhm = peak_widths(smoothed, peaks, rel_height=0.5, prominence_data=(prominences, left_bases, right_bases))[0]
+    fwhm = np.maximum(fwhm, 1.0) * bin_width
+    position = start + (peaks + 0.5) * bin_width
+
+    # the range is a multiple of the FWHM but never reaches into the neighbouring peaks
+    gaps = np.diff(position)
+    spacing = np.minimum(np.append(gaps, np.inf), np.insert(gaps, 0, np.inf))
+    peak_width = np.minimum(peak_range_fwhm * fwhm, spacing)
+
+    # about five binning bins per FWHM, as a power of ten as expected by start_binning
+    cutoff_bin = 10.0 ** np.floor(np.log10(fwhm / 5))
+    cutoff_bin = np.clip(cutoff_bin, bin_width, 0.1)
+    scale = cutoff_bin / bin_width
+    background = np.maximum(smoothed[left_bases], smoothed[right_bases])
+    cutoff_height = np.floor((background + peak_cutoff_fraction * prominences) * scale).astype(np.int64)
+    cutoff_width = np.maximum(0, np.floor(0.5 * fwhm / cutoff_bin)).astype(np.int64)
+
+    return {'peak_MNRatio': position, 'fwhm': fwhm, 'prominence': prominences, 'peak_width': peak_width,
+            'cutoff_bin': cutoff_bin, 'cutoff_height': cutoff_height, 'cutoff_width': cutoff_width}
+
+
+def overlap_design(low, high, patterns):
+    """
+    Fraction of every species that falls into every range according to its isotope pattern
+    :param low: numpy.array of lower range limits (R)
+    :param high: numpy.array of upper range limits (R)
+    :param patterns: list of (m/n positions, abundances) per species (S), positions sorted
+    :return: numpy.array (R, S)
+    """
+    low = np.asarray(low, dtype=np.float64)
+    high = np.asarray(high, dtype=np.float64)
+    design = np.zeros((len(low), len(patterns)))
+    for s, (mn_ratio, abundances) in enumerate(patterns):
+        cumulative = np.concatenate(([0.0], np.cumsum(abundances)))
+        design[:, s] = (cumulative[np.searchsorted(mn_ratio, high, side='right')] -
+                        cumulative[np.searchsorted(mn_ratio, low, side='left')])
+    return design
+
+
+def deconvolve_overlaps(design, counts):
+    """
+    Splits the counts of overlapping ranges between species with a non-negative least squares fit of the isotope
+    ratios. Ranges and species are grouped into overlap families (connected through the design matrix). Families of a
+    single species are solved in closed form all at once, only families with several species need a NNLS solve
+    :param design: numpy.array (R, S) from overlap_design
+    :param counts: numpy.array (R) of ranged counts
+    :return: (numpy.array (S) of fitted species totals, numpy.array (R, S) of counts apportioned per range and species)
+    """
+    design = np.asarray(design, dtype=np.float64)
+    counts = np.asarray(counts, dtype=np.float64)
+    num_ranges, num_species = design.shape
+
+    range_id, species_id = np.nonzero(design > 0)
+    graph = coo_matrix((np.ones(len(range_id)), (range_id, num_ranges + species_id)),
+                       shape=(num_ranges + num_species, num_ranges + num_species))
+    _num_families, family = connected_components(graph, directed=False)
+    species_family = family[num_ranges:]
+
+    # closed form least squares for every species alone
+    norm = (design ** 2).sum(axis=0)
+    totals = np.divide(design.T @ counts, norm, out=np.zeros(num_species), where=norm > 0)
+
+    family_size = np.bincount(species_family)
+    for label in np.flatnonzero(family_size > 1):
+        species = np.flatnonzero(species_family == label)
+        ranges = np.flatnonzero(family[:num_ranges] == label)
+        totals[species] = nnls(design[np.ix_(ranges, species)], counts[ranges])[0]
+
+    expected = design * totals[None, :]
+    expected_sum = expected.sum(axis=1, keepdims=True)
+    share = np.divide(expected, expected_sum, out=np.zeros_like(expected), where=expected_sum > 0)
+    return totals, share * counts[:, None]
+
+
+def _painted(num_bins, first, last):
+    # marks the bins first[i]..last[i] (inclusive) of every interval with one cumulative sum
+    paint = np.zeros(num_bins + 1, dtype=np.int64)
+    np.add.at(paint, np.clip(first, 0, num_bins), 1)
+    np.add.at(paint, np.clip(last + 1, 0, num_bins), -1)
+    return np.cumsum(paint[:-1]) > 0
+
+
+def background_model(spectrum, low, high):
+    """
+    Fits the background of the whole spectrum once. The spectrum is binned uniformly in sqrt(MN_Ratio), where the
+    time of flight background is nearly flat, the bins touched by any range are masked and the density is the moving
+    average of the remaining bins over background_window
+    :param spectrum: dict from build_spectrum_index
+    :param low: numpy.array of lower range limits
+    :param high: numpy.array of upper range limits
+    :return: dict with keys centers (sqrt(MN_Ratio)) and density (counts per unit sqrt(MN_Ratio))
+    """
+    top = np.sqrt(max(float(spectrum['sorted'][-1]), 0.0))
+    num_bins = max(1, int(np.ceil(top / background_bin)))
+    edges = np.arange(num_bins + 1) * background_bin
+    counts = histogram(spectrum, edges ** 2).astype(np.float64)
+
+    first = np.floor(np.sqrt(np.asarray(low, dtype=np.float64)) / background_bin).astype(np.int64)
+    last = np.floor(np.sqrt(np.asarray(high, dtype=np.float64)) / background_bin).astype(np.int64)
+    free = ~_painted(num_bins, first, last)
+
+    half = max(1, int(round(background_window / background_bin)))
+    sum_counts = np.concatenate(([0.0], np.cumsum(np.where(free, counts, 0.0))))
+    sum_free = np.concatenate(([0], np.cumsum(free)))
+    left = np.clip(np.arange(num_bins) - half, 0, num_bins)
+    right = np.clip(np.arange(num_bins) + half + 1, 0, num_bins)
+    num_free = sum_free[right] - sum_free[left]
+    mean = np.divide(sum_counts[right] - sum_counts[left], num_free, out=np.zeros(num_bins), where=num_free > 0)
+    return {'centers': edges[:-1] + background_bin / 2, 'density': mean / background_bin}
+
+
+def background_correction(spectrum, low, high, counts):
+    """
+    Background subtracted counts, peak to background ratio and detection limit of all ranges in one pass
+    :param spectrum: dict from build_spectrum_index
+    :param low: numpy.array of lower range limits
+    :param high: numpy.array of upper range limits
+    :param counts: numpy.array of ranged counts
+    :return: dict of numpy.arrays with keys background, net_count, peak_to_background and detection_limit (counts,
+    Currie limit 2.71 + 4.65 sqrt(background))
+    """
+    low = np.asarray(low, dtype=np.float64)
+    high = np.asarray(high, dtype=np.float64)
+    counts = np.asarray(counts, dtype=np.float64)
+    model = background_model(spectrum, low, high)
+    root_low, root_high = np.sqrt(low), np.sqrt(high)
+    density = np.interp((root_low + root_high) / 2, model['centers'], model['density'])
+    background = density * (root_high - root_low)
+    net_count = np.maximum(counts - background, 0.0)
+    peak_to_background = np.divide(net_count, background, out=np.full(len(counts), np.inf), where=background > 0)
+    detection_limit = 2.71 + 4.65 * np.sqrt(background)
+    return {'background': background, 'net_count': net_count, 'peak_to_background': peak_to_background,
+            'detection_limit': detection_limit}
@@ -5,13 +5,18 @@ import math
 import os
 import re
 import sys
-from collections import Counter
+from collections import Counter, OrderedDict
 from collections import defaultdict
 from typing import Dict
 import pickle
 import matplotlib.pyplot as plt
 
 import common
+import datastore
+import elements
+import ranging
+import spatial
+import spectrum
 from UI import Ui_APTMainWindow, Ui_InputElementTable, Ui_PeriodicTable, Ui_MonoLayer, Ui_DecomposeList, \
     Ui_AbstractLayer, Ui_SRO, Ui_CompositionMap
 
@@ -21,22 +26,19 @@ import pandas as pd
 from IPython.external.qt_for_kernel import QtCore
 from PyQt5 import QtGui
 from PyQt5.QtCore import QEvent, Qt
-from PyQt5.QtGui import QCursor, QStandardItemModel, QStandardItem
+from PyQt5.QtGui import QCursor
 from PyQt5.QtWidgets import QMainWindow, QFileDialog, QDialog, QVBoxLayout, QTableWidgetItem, \
-    QHeaderView, QLineEdit, QLabel, QDialogButtonBox
+    QHeaderView, QLineEdit, QLabel, QDialogButtonBox, QCheckBox, QPushButton, QWidget, QGridLayout, QTableView, QAction
 from ase.io import read
 from ase.neighborlist import NeighborList, NewPrimitiveNeighborList
 from matplotlib.backends.backend_qt5 import NavigationToolbar2QT
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 from matplotlib.figure import Figure
-from natsort import index_natsorted, order_by_index
+from natsort import index_natsorted
 from scipy import special
 from scipy.signal import savgol_filter
-from scipy.spatial import ConvexHull, Delaunay
-from silx.gui.widgets.PeriodicTable import PeriodicTable
-# Remember that the above non-project library file was hard edited to add D to the periodic table
-# This is a really bad practice, and needs to be changed. The git repository wont reflect this addition for example
+from scipy.spatial import ConvexHull
 from sklearn.cluster import DBSCAN
 from sklearn.neighbors import KDTree
 
@@ -49,8 +51,20 @@ pickle.HIGHEST_PROTOCOL = 4
 # Functions defined in the common class
 show_message = common.show_message
 
-# maximum number of ions can be specified here
-max_ions = 50
+# maximum number of ions (range rows) can be specified here, the input table starts with table_rows rows and grows
+max_ions = 5000
+table_rows = 50
+# number of formatted cells kept by the table model of the main window
+table_cache_size = 20000
+# maximum distance (nm) on either side of the interface that is covered by the proxigram
+proxigram_max_distance = 5.0
+# background colors of the periodic table buttons per element category
+element_colors = {'alkali metal': '#ffb3a7', 'alkaline earth metal': '#ffdead', 'transition metal': '#ffe4b5',
+                  'post-transition metal': '#d3d3d3', 'metalloid': '#cde6c0', 'nonmetal': '#b0e0a0',
+                  'halogen': '#fffacd', 'noble gas': '#c0ffff', 'lanthanide': '#ffbfff', 'actinide': '#ff99cc'}
+# columns read from the HDF file by the analysis dialogs (None reads all). ION brings the species columns along
+monolayer_columns = ['X', 'Y', 'Z', 'MN_Ratio', 'peak_no', 'ION', 'ion', 'num']
+sro_columns = ['X', 'Y', 'Z', 'ION', 'ion']
 # The dictionary of ions for global use and update. Each ion will be one element_dict.
 element_dict = {'ion': [], 'num': [], 'mass': [], 'charge': []}
 cutoff_dict = {'peak_MNRatio': float, 'peak_width': float, 'cutoff_bin': float, 'cutoff_height': int,
@@ -61,93 +75,134 @@ element_dict_array: Dict[int, dict] = {}
 cutoff_dict_array: Dict[int, dict] = {}
 
 
-# The following class is used to visualize the dataframe inside the main window. The column size could be readjusted.
-# reference: https://stackoverflow.com/questions/44603119/how-to-display-a-pandas-data-frame-with-pyqt5-pyside2
+# The following class is used to visualize a dataframe inside the main window without copying it. The model only keeps
+# references to the column arrays, formats the cells that are actually drawn and keeps the most recent strings in a LRU
+# cache, so that tables of tens of millions of rows can be scrolled smoothly. Sorting a column computes its argsort
+# permutation once (natural order for string columns), caches it and presents the rows through it, the arrays are
+# never reordered
 # Does not inherit any UI files
-class DataFrameModel(QtCore.QAbstractTableModel):
+class ArrayTableModel(QtCore.QAbstractTableModel):
     DtypeRole = QtCore.Qt.UserRole + 1000
     ValueRole = QtCore.Qt.UserRole + 1001
 
-    def __init__(self, df=pd.DataFrame(), parent=None):
-        super(DataFrameModel, self).__init__(parent)
-        self._dataframe = df
+    def __init__(self, df=None, parent=None):
+        super(ArrayTableModel, self).__init__(parent)
+        self._columns = []
+        self._headers = []
+        self._index = None
+        self._cache = OrderedDict()
+        self._order = None
+        self._sort_cache = {}
+        if df is not None:
+            self.setDataFrame(df)
 
     def setDataFrame(self, dataframe):
+        # to_numpy returns views of the dataframe blocks for columns with a numeric dtype, the index is kept as object
+        # (a RangeIndex is not materialized) and only the labels of the drawn rows are looked up
+        self.setArrays([dataframe.iloc[:, i].to_numpy() for i in range(dataframe.shape[1])],
+                       [str(column) for column in dataframe.columns], dataframe.index)
+
+    def setArrays(self, columns, headers, index=None):
         self.beginResetModel()
-        self._dataframe = dataframe.copy()
+        self._columns = list(columns)
+        self._headers = list(headers)
+        self._index = index
+        self._cache.clear()
+        self._order = None
+        self._sort_cache = {}
         self.endResetModel()
 
-    def dataFrame(self):
-        return self._dataframe
+    # returns the row of the arrays that is shown at the given row of the view
+    def sourceRow(self, row):
+        if self._order is None:
+            return row
+        return self._order[row]
+
+    # ascending permutation of a column, strings are sorted in natural order and numbers with a stable argsort
+    def sortPermutation(self, column):
+        if column not in self._sort_cache:
+            values = self._columns[column]
+            if values.dtype.kind in 'OSU':
+                permutation = np.asarray(index_natsorted(values), dtype=np.int64)
+            else:
+                permutation = np.argsort(values, kind='stable')
+            self._sort_cache[column] = permutation
+        return self._sort_cache[column]
 
-    dataFrame = QtCore.pyqtProperty(pd.DataFrame, fget=dataFrame, fset=setDataFrame)
+    def sort(self, column, order=QtCore.Qt.AscendingOrder):
+        if not 0 <= column < self.columnCount():
+            return
+        self.layoutAboutToBeChanged.emit()
+        permutation = self.sortPermutation(column)
+        self._order = permutation if order == QtCore.Qt.AscendingOrder else permutation[::-1]
+        self.layoutChanged.emit()
 
     @QtCore.pyqtSlot(int, QtCore.Qt.Orientation, result=str)
     def headerData(self, section: int, orientation: QtCore.Qt.Orientation, role: int = QtCore.Qt.DisplayRole):
         if role == QtCore.Qt.DisplayRole:
             if orientation == QtCore.Qt.Horizontal:
-                return self._dataframe.columns[section]
-            else:
-                return str(self._dataframe.index[section])
+                return self._headers[section]
+            if self._index is not None:
+                return str(self._index[self.sourceRow(section)])
+            return str(section)
         return QtCore.QVariant()
 
     def rowCount(self, parent=QtCore.QModelIndex()):
-        if parent.isValid():
+        if parent.isValid() or not self._columns:
             return 0
-        return len(self._dataframe.index)
+        return len(self._columns[0])
 
     def columnCount(self, parent=QtCore.QModelIndex()):
         if parent.isValid():
             return 0
-        return self._dataframe.columns.size
+        return len(self._columns)
 
     def data(self, index, role=QtCore.Qt.DisplayRole):
         if not index.isValid() or not (0 <= index.row() < self.rowCount() and 0 <= index.column() < self.columnCount()):
             return QtCore.QVariant()
-        row = self._dataframe.index[index.row()]
-        col = self._dataframe.columns[index.column()]
-        dt = self._dataframe[col].dtype
+        row = self.sourceRow(index.row())
+        col = index.column()
 
-        val = self._dataframe.iloc[row][col]
         if role == QtCore.Qt.DisplayRole:
-            return str(val)
-        elif role == DataFrameModel.ValueRole:
-            return val
-        if role == DataFrameModel.DtypeRole:
-            return dt
+            key = (row, col)
+            text = self._cache.get(key)
+            if text is None:
+                text = str(self._columns[col][row])
+                self._cache[key] = text
+                if len(self._cache) > table_cache_size:
+                    self._cache.popitem(last=False)
+            else:
+                self._cache.move_to_end(key)
+            return text
+        elif role == ArrayTableModel.ValueRole:
+            return self._columns[col][row]
+        if role == ArrayTableModel.DtypeRole:
+            return self._columns[col].dtype
         return QtCore.QVariant()
 
     def roleNames(self):
         roles = {
             QtCore.Qt.DisplayRole: b'display',
-            DataFrameModel.DtypeRole: b'dtype',
-            DataFrameModel.ValueRole: b'value'
+            ArrayTableModel.DtypeRole: b'dtype',
+            ArrayTableModel.ValueRole: b'value'
         }
         return roles
 
-    def sort(self, column, order):
-        self.layoutAboutToBeChanged.emit()
-        if order == 0:
-            self._dataframe = self._dataframe.reindex(index=order_by_index(self._dataframe.index, index_natsorted(
-                eval('self._dataframe.%s' % (list(self._dataframe.columns)[column])))))
-        else:
-            self._dataframe = self._dataframe.reindex(index=order_by_index(self._dataframe.index, reversed(
-                index_natsorted(eval('self._dataframe.%s' % (list(self._dataframe.columns)[column]))))))
-
-        self._dataframe.reset_index(inplace=True, drop=True)
-        self.setDataFrame(self._dataframe)
-        self.layoutChanged.emit()
-
 
-# Class used to plot and display histogram
+# Class used to plot and display histogram. The spectrum is drawn as a single step outline from a histogram pyramid and
+# rebinned to the level that matches the visible range on every pan/zoom, so the full range stays interactive at 0.001 Da
 # Does not inherit any UI files
 class HistogramWindow(QDialog):
-    def __init__(self, subset_df_apt_hist, parent=None):
+    def __init__(self, spectrum_index, bin_width, xlim_left, xlim_right, parent=None):
         super(HistogramWindow, self).__init__(parent)
 
         # a figure instance to plot on
         self.figure = Figure()
-        self.subset_df_apt_hist = subset_df_apt_hist
+        self.pyramid = spectrum.histogram_pyramid(spectrum_index, bin_width)
+        self.xlim_left = xlim_left
+        self.xlim_right = xlim_right
+        self.ax = None
+        self.line = None
 
         # this is the Canvas Widget that displays the `figure`
         # it takes the `figure` instance as a parameter to __init__
@@ -157,30 +212,112 @@ class HistogramWindow(QDialog):
         # it takes the Canvas widget and a parent
         self.toolbar = NavigationToolbar2QT(self.canvas, self)
 
+        self.checkBox_log = QCheckBox("Log scale")
+        self.checkBox_log.stateChanged.connect(self.set_log_scale)
+
         # set the layout
         layout = QVBoxLayout()
         layout.addWidget(self.toolbar)
         layout.addWidget(self.canvas)
+        layout.addWidget(self.checkBox_log)
         self.setLayout(layout)
         self.plot()
 
     def plot(self):
         # create an axis
-        ax = self.figure.add_subplot(111)
+        self.ax = self.figure.add_subplot(111)
 
         # discards the old graph
-        ax.clear()
+        self.ax.clear()
 
         # plot data
-        ax.title.set_text('APT Spectrum')
-        ax.set_xlabel('MN_Ratio')
-        ax.set_ylabel('Counts')
-        ax.bar(self.subset_df_apt_hist.bin_lower, self.subset_df_apt_hist.freq,
-               width=self.subset_df_apt_hist.bin_upper - self.subset_df_apt_hist.bin_lower, ec="k", align="edge")
+        self.ax.set_xlabel('MN_Ratio')
+        self.ax.set_ylabel('Counts')
+        self.line, = self.ax.plot([], [], drawstyle='steps-post', linewidth=0.8)
+        self.ax.set_xlim(self.xlim_left, self.xlim_right)
+        self.update_view(self.ax)
+        self.ax.callbacks.connect('xlim_changed', self.update_view)
 
         # refresh canvas
         self.canvas.draw()
 
+    # picks the pyramid level for the visible range and replaces the step outline
+    def update_view(self, ax):
+        x_left, x_right = ax.get_xlim()
+        edges, counts, width = spectrum.pyramid_view(self.pyramid, x_left, x_right)
+        if len(counts) == 0:
+            self.line.set_data([], [])
+        else:
+            self.line.set_data(edges, np.append(counts, counts[-1]))
+            top = counts.max()
+            if ax.get_yscale() == 'log':
+                ax.set_ylim(0.5, max(1, top) * 2)
+            else:
+                ax.set_ylim(0, max(1, top) * 1.05)
+        ax.title.set_text('APT Spectrum (bin width ' + str(round(width, 6)) + ' Da)')
+        self.canvas.draw_idle()
+
+    def set_log_scale(self):
+        self.ax.set_yscale('log' if self.checkBox_log.isChecked() else 'linear')
+        self.update_view(self.ax)
+
+
+# Shows a dataframe in its own window (through ArrayTableModel) with an option to save it as csv file
+# Does not inherit any UI files
+class TableWindow(QDialog):
+    def __init__(self, df, title, parent=None):
+        super(TableWindow, self).__init__(parent)
+        self.df = df
+        self.setWindowTitle(title)
+
+        self.tableView = QTableView()
+        self.tableView.setSortingEnabled(True)
+        self.tableView.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.model = ArrayTableModel(df)
+        self.tableView.setModel(self.model)
+        self.tableView.resizeColumnsToContents()
+        self.pushButton_save = QPushButton("Save Table (.csv)")
+        self.pushButton_save.clicked.connect(self.save_table)
+
+        layout = QVBoxLayout()
+        layout.addWidget(self.tableView)
+        layout.addWidget(self.pushButton_save)
+        self.setLayout(layout)
+        self.resize(900, 600)
+
+    def save_table(self):
+        csv_file, extension = QFileDialog.getSaveFileName(self, 'Save File', '.', filter=self.tr("csv file (*.csv)"))
+        if csv_file:
+            try:
+                self.df.to_csv(csv_file, index=False)
+            except IOError:
+                common.show_message("I/O error")
+
+
+# Periodic table built from the bundled element table (Extras/elements.csv) with one button per element. Clicking an
+# element emits its properties as a dict (symbol, Z, name, mass, row, column, category)
+# Does not inherit any UI files
+class PeriodicTableWidget(QWidget):
+    sigElementClicked = QtCore.pyqtSignal(object)
+
+    def __init__(self, parent=None):
+        super(PeriodicTableWidget, self).__init__(parent)
+
+        layout = QGridLayout()
+        layout.setSpacing(2)
+        table = elements.load_elements()
+        for i in range(len(table['symbol'])):
+            symbol = str(table['symbol'][i])
+            button = QPushButton(symbol)
+            button.setFixedSize(34, 30)
+            button.setToolTip("%s (%d), %.4f Da" % (table['name'][i], table['Z'][i], table['mass'][i]))
+            button.setStyleSheet("background-color: %s" % element_colors[str(table['category'][i])])
+            button.clicked.connect(lambda checked, symbol=symbol: self.sigElementClicked.emit(elements.element(symbol)))
+            layout.addWidget(button, table['row'][i] - 1, table['column'][i] - 1)
+        # empty row between the main table and the lanthanides/actinides
+        layout.setRowMinimumHeight(7, 12)
+        self.setLayout(layout)
+
 
 # The class shows an on-the-top dialog that can input num of elements and mass (different from default for isotope).
 # Does not inherit any UI files
@@ -218,7 +355,10 @@ class PeriodicTableCustom(Ui_PeriodicTable.Ui_Form, QDialog):
         self.lineEdit.setText("0")
         self.curr_row = None
 
-        self.ptable = PeriodicTable(self.widget, selectable=False)
+        self.ptable = PeriodicTableWidget()
+        ptable_layout = QVBoxLayout(self.widget)
+        ptable_layout.setContentsMargins(0, 0, 0, 0)
+        ptable_layout.addWidget(self.ptable)
         self.ptable.sigElementClicked.connect(self.click_table)
         self.inputDialog.setWindowModality(QtCore.Qt.ApplicationModal)
         self.pushButton_2.clicked.connect(self.delete)
@@ -248,7 +388,7 @@ class PeriodicTableCustom(Ui_PeriodicTable.Ui_Form, QDialog):
 
     def click_table(self, item):
         self.showdialogTOP()
-        self.inputDialog.lineedit2.setText(str(item.mass))
+        self.inputDialog.lineedit2.setText(str(item['mass']))
         self.inputDialog.lineedit.setText(str(1))
         ok = self.inputDialog.exec_()
 
@@ -259,7 +399,7 @@ class PeriodicTableCustom(Ui_PeriodicTable.Ui_Form, QDialog):
             if len(element_dict['ion']) == 0:
                 self.lineEdit_3.setText("")
 
-            element_dict['ion'].append(str(item.symbol))
+            element_dict['ion'].append(str(item['symbol']))
             element_dict['num'].append(elem_num)
             element_dict['mass'].append(elem_mass)
             element_dict['charge'] = [self.emit_charge()]
@@ -292,21 +432,111 @@ class PeriodicTableCustom(Ui_PeriodicTable.Ui_Form, QDialog):
         event.accept()
 
 
+# The following class presents the rows of the input elements table (element_dict_array and cutoff_dict_array) to a
+# QTableView. The cells are formatted from the dictionaries when they are drawn and an edited cutoff cell is written
+# straight back into cutoff_dict_array, so the table holds no items and thousands of rows stay responsive
+# Does not inherit any UI files
+class RangeTableModel(QtCore.QAbstractTableModel):
+    headers = ["ION", "peak_MNRatio(Da)", "MNRatio_width(Da)", "cutoff_bin", "cutoff_height", "cutoff_width"]
+    keys = [None, 'peak_MNRatio', 'peak_width', 'cutoff_bin', 'cutoff_height', 'cutoff_width']
+
+    def __init__(self, parent=None):
+        super(RangeTableModel, self).__init__(parent)
+        self._rows = table_rows
+
+    # text of the ION cell, e.g. Fe₂O₃(2+)
+    @staticmethod
+    def ionText(ion):
+        text = ''
+        for i in range(len(ion['ion'])):
+            text = text + str(ion['ion'][i]) + common.subscript(str(ion['num'][i]))
+        if text:
+            text = text + '(' + str(ion['charge'][0]) + ')'
+        return text
+
+    # grows the table so that it has room for the given number of rows (plus empty ones to type in)
+    def ensureRows(self, num_rows):
+        num_rows = min(max_ions, max(table_rows, num_rows + 10))
+        if num_rows > self._rows:
+            self.beginInsertRows(QtCore.QModelIndex(), self._rows, num_rows - 1)
+            self._rows = num_rows
+            self.endInsertRows()
+
+    # redraws the table after the dictionaries were refilled
+    def refresh(self):
+        keys = [int(key) for key in list(element_dict_array.keys()) + list(cutoff_dict_array.keys())]
+        self.beginResetModel()
+        self._rows = min(max_ions, max(table_rows, max(keys) + 11 if keys else 0))
+        self.endResetModel()
+
+    def refreshRow(self, row):
+        self.ensureRows(row + 1)
+        self.dataChanged.emit(self.index(row, 0), self.index(row, self.columnCount() - 1))
+
+    @QtCore.pyqtSlot(int, QtCore.Qt.Orientation, result=str)
+    def headerData(self, section: int, orientation: QtCore.Qt.Orientation, role: int = QtCore.Qt.DisplayRole):
+        if role == QtCore.Qt.DisplayRole:
+            if orientation == QtCore.Qt.Horizontal:
+                return self.headers[section]
+            return str(section + 1)
+        return QtCore.QVariant()
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return self._rows
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.headers)
+
+    def flags(self, index):
+        flags = QtCore.Qt.ItemIsEnabled | QtCore.Qt.ItemIsSelectable
+        if index.column() > 0:
+            flags |= QtCore.Qt.ItemIsEditable
+        return flags
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid() or role not in (QtCore.Qt.DisplayRole, QtCore.Qt.EditRole):
+            return QtCore.QVariant()
+        key = str(index.row())
+        if index.column() == 0:
+            if key in element_dict_array:
+                return self.ionText(element_dict_array[key])
+            return ''
+        value = cutoff_dict_array.get(key, {}).get(self.keys[index.column()])
+        if value is None:
+            return ''
+        return str(value)
+
+    def setData(self, index, value, role=QtCore.Qt.EditRole):
+        if not index.isValid() or role != QtCore.Qt.EditRole or index.column() == 0:
+            return False
+        cutoff = cutoff_dict_array.setdefault(str(index.row()), {name: None for name in self.keys[1:]})
+        cutoff[self.keys[index.column()]] = str(value).strip() or None
+        self.dataChanged.emit(index, index)
+        self.ensureRows(index.row() + 1)
+        return True
+
+
 # The class inherits a custom UI layout and has facility to complete the input elements table as well as cutoff values
 # Inherits from Ui_InputElementTable
 class InputElementTable(Ui_InputElementTable.Ui_Form, QDialog):
-    def __init__(self, parent=None):
+    def __init__(self, spectrum_index=None, data_file=None, parent=None):
         super(InputElementTable, self).__init__(parent)
         self.setupUi(self)
+        self.spectrum_index = spectrum_index
+        self.data_file = data_file
 
-        self.tableWidget.setRowCount(max_ions)
-        self.tableWidget.setColumnCount(6)
-        self.tableWidget.setHorizontalHeaderItem(0, QTableWidgetItem("ION"))
-        self.tableWidget.setHorizontalHeaderItem(1, QTableWidgetItem("peak_MNRatio(Da)"))
-        self.tableWidget.setHorizontalHeaderItem(2, QTableWidgetItem("MNRatio_width(Da)"))
-        self.tableWidget.setHorizontalHeaderItem(3, QTableWidgetItem("cutoff_bin"))
-        self.tableWidget.setHorizontalHeaderItem(4, QTableWidgetItem("cutoff_height"))
-        self.tableWidget.setHorizontalHeaderItem(5, QTableWidgetItem("cutoff_width"))
+        # the rows are drawn from element_dict_array / cutoff_dict_array through a model instead of one item per cell,
+        # the item table of the layout stays hidden (other dialogs reuse it as a plain table)
+        self.model = RangeTableModel(self)
+        self.tableView = QTableView(self.frame)
+        self.tableView.setModel(self.model)
+        self.tableView.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.gridLayout.addWidget(self.tableView, 0, 0, 1, 1)
+        self.tableWidget.setVisible(False)
         self.PeriodicTableCustom = None
         self.row = 0
         self.col = 0
@@ -318,18 +548,35 @@ class InputElementTable(Ui_InputElementTable.Ui_Form, QDialog):
         self.setMinimumSize(500, 500)
         self.setGeometry(QtCore.QRect(417, 220, 666, 653))
 
-        header = self.tableWidget.horizontalHeader()
+        header = self.tableView.horizontalHeader()
         header.setSectionResizeMode(0, QHeaderView.Stretch)
         header.setSectionResizeMode(1, QHeaderView.ResizeToContents)
         header.setSectionResizeMode(2, QHeaderView.ResizeToContents)
         header.setSectionResizeMode(3, QHeaderView.ResizeToContents)
         header.setSectionResizeMode(4, QHeaderView.ResizeToContents)
 
-        self.tableWidget.cellClicked.connect(self.cell_was_clicked)
-        self.tableWidget.cellDoubleClicked.connect(self.cell_was_clicked)
+        self.tableView.clicked.connect(self.index_was_clicked)
+        self.tableView.doubleClicked.connect(self.index_was_clicked)
         self.pushButton_2.clicked.connect(self.export_table)
         self.pushButton.clicked.connect(self.import_table)
-        viewport = self.tableWidget.viewport()
+
+        # proposes the ranges and cutoffs of the spectrum peaks, the ions can then be assigned from the periodic table
+        self.pushButton_detect = QPushButton("Detect Peaks")
+        self.pushButton_detect.setToolTip("Find the peaks of the loaded spectrum and fill their ranges and cutoffs")
+        self.pushButton_detect.setEnabled(spectrum_index is not None)
+        self.pushButton_detect.clicked.connect(self.detect_peaks)
+        self.horizontalLayout.insertWidget(2, self.pushButton_detect)
+        self.pushButton_isotopes = QPushButton("Isotope Peaks")
+        self.pushButton_isotopes.setToolTip("Add a row for every isotopic peak (above 1 %) of the ions in the table")
+        self.pushButton_isotopes.clicked.connect(self.add_isotope_peaks)
+        self.horizontalLayout.insertWidget(3, self.pushButton_isotopes)
+        self.pushButton_sweep = QPushButton("Sweep Cutoffs")
+        self.pushButton_sweep.setToolTip("Evaluate a grid of cutoff_bin, cutoff_height and cutoff_width for every row")
+        self.pushButton_sweep.setEnabled(spectrum_index is not None)
+        self.pushButton_sweep.clicked.connect(self.sweep_cutoffs)
+        self.horizontalLayout.insertWidget(4, self.pushButton_sweep)
+        self.sweep_window = None
+        viewport = self.tableView.viewport()
         viewport.installEventFilter(self)
 
     def saveFileDialog(self):
@@ -340,46 +587,23 @@ class InputElementTable(Ui_InputElementTable.Ui_Form, QDialog):
         if fileName:
             return fileName + '.csv'
 
+    # the cutoff cells are stored while they are edited, every row with an ion gets a complete cutoff entry (None for
+    # the empty cells) so that it is matched with its cutoff values
     def submit(self):
-        key = None
-        for r in range(max_ions):
-            for c in range(1, 4):
-                if c == 1:
-                    key = 'ion'
-                if c == 2:
-                    key = 'num'
-                if c == 3:
-                    key = 'mass'
-                if c == 4:
-                    key = 'charge'
-
-            for c in range(1, 6):
-                if c == 1:
-                    key = 'peak_MNRatio'
-                if c == 2:
-                    key = 'peak_width'
-                if c == 3:
-                    key = 'cutoff_bin'
-                if c == 4:
-                    key = 'cutoff_height'
-                if c == 5:
-                    key = 'cutoff_width'
-
-                if self.tableWidget.item(r, c):
-                    cutoff_dict[key] = self.tableWidget.item(r, c).text()
-                else:
-                    cutoff_dict[key] = None
-
-            cutoff_dict_array[str(r)] = dict()
-            cutoff_dict_array[str(r)]['peak_MNRatio'] = cutoff_dict['peak_MNRatio']
-            cutoff_dict_array[str(r)]['peak_width'] = cutoff_dict['peak_width']
-            cutoff_dict_array[str(r)]['cutoff_bin'] = cutoff_dict['cutoff_bin']
-            cutoff_dict_array[str(r)]['cutoff_height'] = cutoff_dict['cutoff_height']
-            cutoff_dict_array[str(r)]['cutoff_width'] = cutoff_dict['cutoff_width']
+        for key in element_dict_array:
+            if key not in cutoff_dict_array:
+                cutoff_dict_array[key] = {name: None for name in RangeTableModel.keys[1:]}
 
     def export_table(self):
         csv_file, extension = QFileDialog.getSaveFileName(
-            self, 'Save File', '.', filter=self.tr("csv file (*.csv)"))
+            self, 'Save File', '.', filter=self.tr("csv file (*.csv);;range file (*.rrng *.rng)"))
+        if os.path.splitext(csv_file)[1].lower() in ('.rng', '.rrng'):
+            self.export_range_file(csv_file)
+            return
+        self.write_table(csv_file)
+
+    # Writes the rows of the table in the *_input_table.csv format read by import_table
+    def write_table(self, csv_file):
         csv_columns = ['ion', 'num', 'mass', 'charge', 'peak_MNRatio', 'peak_width',
                        'cutoff_bin', 'cutoff_height', 'cutoff_width']
 
@@ -389,7 +613,7 @@ class InputElementTable(Ui_InputElementTable.Ui_Form, QDialog):
         list1 = [int(i) for i in list1]
         list2 = list(cutoff_dict_array.keys())
         list2 = [int(i) for i in list2]
-        if min(list1) <= min(list2):
+        if list1 and min(list1) <= min(list2):
             for key1 in element_dict_array:
                 x = element_dict_array[key1]
                 if int(key1) in list2:
@@ -433,9 +657,73 @@ class InputElementTable(Ui_InputElementTable.Ui_Form, QDialog):
         except IOError:
             common.show_message("I/O error")
 
+    # Writes the complete rows as range file, the range of a row is its window peak_MNRatio +- peak_width / 2
+    def export_range_file(self, file_name):
+        self.submit()
+        low, high, composition = [], [], []
+        for key in sorted(cutoff_dict_array, key=int):
+            cutoff = cutoff_dict_array[key]
+            ion = element_dict_array.get(key, {})
+            try:
+                peak, width = float(cutoff['peak_MNRatio']), float(cutoff['peak_width'])
+                formula = elements.formula_key(ion['ion'], ion['num'])
+            except (KeyError, TypeError, ValueError):
+                continue
+            low.append(peak - width / 2)
+            high.append(peak + width / 2)
+            composition.append(formula)
+        if not low:
+            common.show_message("Complete the ion and range of at least one row to export a range file")
+            return
+
+        overlaps = ranging.find_overlaps(np.array(low), np.array(high))
+        if len(overlaps) > 0:
+            common.show_message("%d of the exported ranges overlap" % len(overlaps))
+        try:
+            ranging.write_range_file(file_name, {'low': low, 'high': high, 'composition': composition})
+        except IOError:
+            common.show_message("I/O error")
+
+    # Fills the table from a .rng/.rrng range file, every range becomes a row with a fixed range (cutoff_bin 'fixed')
+    # that is used as it is by start_binning. The charge state is estimated from the formula mass and the range center
+    def import_range_file(self, file_name):
+        try:
+            ranges = ranging.read_range_file(file_name)
+        except (IOError, ValueError, IndexError, StopIteration):
+            common.show_message("The range file could not be read")
+            return
+        if len(ranges['low']) > max_ions:
+            common.show_message("Only the first " + str(max_ions) + " ranges were imported")
+
+        for r, (low, high, composition) in enumerate(zip(ranges['low'][:max_ions], ranges['high'][:max_ions],
+                                                         ranges['composition'][:max_ions])):
+            center = (low + high) / 2
+            if composition:
+                ions = [symbol for symbol, _ in composition]
+                try:
+                    masses = elements.atomic_masses(ions)
+                except KeyError:
+                    masses = None
+                if masses is not None:
+                    nums = [count for _, count in composition]
+                    charge = max(1, int(round(float(np.dot(masses, nums)) / center)))
+                    element_dict_array[str(r)] = dict()
+                    element_dict_array[str(r)]['ion'] = ions
+                    element_dict_array[str(r)]['num'] = [str(num) for num in nums]
+                    element_dict_array[str(r)]['mass'] = [str(mass) for mass in masses]
+                    element_dict_array[str(r)]['charge'] = [str(charge) + '+']
+
+            cutoff_dict_array[str(r)] = dict()
+            # full precision, so that the fixed range reproduces the bounds of the file
+            cutoff_dict_array[str(r)]['peak_MNRatio'] = repr(float(center))
+            cutoff_dict_array[str(r)]['peak_width'] = repr(float(high - low))
+            cutoff_dict_array[str(r)]['cutoff_bin'] = 'fixed'
+            cutoff_dict_array[str(r)]['cutoff_height'] = '0'
+            cutoff_dict_array[str(r)]['cutoff_width'] = '0'
+
     def import_table(self):
         csv_file, extension = QFileDialog.getOpenFileName(
-            self, 'Save File', '.', filter=self.tr("csv file (*.csv)"))
+            self, 'Save File', '.', filter=self.tr("csv file (*.csv);;range file (*.rng *.rrng)"))
 
         for value in element_dict.values():
             del value[:]
@@ -445,10 +733,15 @@ class InputElementTable(Ui_InputElementTable.Ui_Form, QDialog):
         element_dict_array.clear()
         cutoff_dict_array.clear()
 
-        if csv_file:
+        if os.path.splitext(csv_file)[1].lower() in ('.rng', '.rrng'):
+            self.import_range_file(csv_file)
+        elif csv_file:
             try:
                 with open(csv_file, "r") as fileInput:
                     for row_num, row in enumerate(csv.reader(fileInput)):
+                        if row_num > max_ions:
+                            common.show_message("Only the first " + str(max_ions) + " rows were imported")
+                            break
                         if row_num > 0:
                             r = row_num - 1
                             if row[0] != '':
@@ -470,50 +763,99 @@ class InputElementTable(Ui_InputElementTable.Ui_Form, QDialog):
 
         self.refresh_table()
 
+    # Fills the cutoff columns with the ranges proposed by the peak detection, use Export Table to save them as csv
+    def detect_peaks(self):
+        peaks = spectrum.detect_peaks(self.spectrum_index, max_peaks=max_ions)
+        if len(peaks['peak_MNRatio']) == 0:
+            common.show_message("No peaks were found in the spectrum")
+            return
+
+        for value in element_dict.values():
+            del value[:]
+        element_dict_array.clear()
+        cutoff_dict_array.clear()
+
+        for r in range(len(peaks['peak_MNRatio'])):
+            digits = int(round(-np.log10(peaks['cutoff_bin'][r])))
+            cutoff_dict_array[str(r)] = dict()
+            cutoff_dict_array[str(r)]['peak_MNRatio'] = str(round(peaks['peak_MNRatio'][r], 3))
+            cutoff_dict_array[str(r)]['peak_width'] = str(round(peaks['peak_width'][r], 3))
+            cutoff_dict_array[str(r)]['cutoff_bin'] = str(round(peaks['cutoff_bin'][r], digits))
+            cutoff_dict_array[str(r)]['cutoff_height'] = str(peaks['cutoff_height'][r])
+            cutoff_dict_array[str(r)]['cutoff_width'] = str(peaks['cutoff_width'][r])
+
+        self.refresh_table()
+
+        # the proposed ranges are saved as input table of the dataset (Input_Elements_Table/<data>_input_table.csv)
+        table_dir = os.path.join(os.getcwd(), "Input_Output", "Input_Elements_Table")
+        if not os.path.isdir(table_dir):
+            table_dir = os.getcwd()
+        name = os.path.splitext(os.path.basename(self.data_file))[0] if self.data_file else "detected"
+        csv_file, extension = QFileDialog.getSaveFileName(
+            self, 'Save Input Table', os.path.join(table_dir, name + "_input_table.csv"),
+            filter=self.tr("csv file (*.csv)"))
+        if csv_file:
+            self.write_table(csv_file)
+
+    # Runs the cutoff parameter sweep for all complete rows and shows the peaks found for every candidate
+    def sweep_cutoffs(self):
+        self.submit()
+        table_rows, rows = [], []
+        for key in sorted(cutoff_dict_array, key=int):
+            cutoff = cutoff_dict_array[key]
+            try:
+                rows.append((float(cutoff['peak_MNRatio']), float(cutoff['peak_width']), float(cutoff['cutoff_bin']),
+                             int(cutoff['cutoff_height']), int(cutoff['cutoff_width'])))
+                table_rows.append(int(key))
+            except (TypeError, ValueError):
+                continue
+        if not rows:
+            common.show_message("Complete the cutoff values of at least one row to sweep them")
+            return
+
+        sweep = ranging.sweep_rows(self.spectrum_index, rows)
+        sweep['row'] = np.array(table_rows)[sweep['row']] + 1
+        self.sweep_window = TableWindow(pd.DataFrame(sweep), "Cutoff Parameter Sweep")
+        self.sweep_window.show()
+
+    # Expands every ion of the table into rows for its isotopic peaks (positions from the bundled isotope table), the
+    # cutoff values of the original row are kept. Rows without ion are left as they are
+    def add_isotope_peaks(self):
+        self.submit()
+        rows = []
+        for r in range(self.model.rowCount()):
+            cutoff = cutoff_dict_array.get(str(r), {})
+            if str(r) in element_dict_array:
+                ion = element_dict_array[str(r)]
+                try:
+                    peaks, _relative = elements.isotope_peaks(ion['ion'], ion['num'], ion['charge'])
+                except (KeyError, ValueError) as error:
+                    common.show_message("Isotope peaks could not be computed: " + str(error))
+                    return
+                for peak in peaks:
+                    row_cutoff = dict(cutoff)
+                    row_cutoff['peak_MNRatio'] = str(round(peak, 3))
+                    rows.append(({key: list(value) for key, value in ion.items()}, row_cutoff))
+            elif any(cutoff.values()):
+                rows.append((None, dict(cutoff)))
+
+        if len(rows) > max_ions:
+            common.show_message("Only the first " + str(max_ions) + " isotopic peaks fit into the table")
+            rows = rows[:max_ions]
+
+        for value in element_dict.values():
+            del value[:]
+        element_dict_array.clear()
+        cutoff_dict_array.clear()
+        for r, (ion, cutoff) in enumerate(rows):
+            if ion is not None:
+                element_dict_array[str(r)] = ion
+            cutoff_dict_array[str(r)] = cutoff
+
+        self.refresh_table()
+
     def refresh_table(self):
-        if len(element_dict_array) != 0:
-            for key in element_dict_array:
-                if eval(key) is not None:
-                    row = int(key)
-                    value = ''
-                    for ii in range(len(element_dict_array[key]['ion'])):
-                        value = value + element_dict_array[key]['ion'][ii] + common.subscript(
-                            element_dict_array[key]['num'][ii])
-                        if ii == len(element_dict_array[key]['ion']) - 1:
-                            value = value + '(' + element_dict_array[key]['charge'][0] + ')'
-
-                    item_ion = QTableWidgetItem()
-                    item_ion.setText(value)
-                    self.tableWidget.setItem(row, 0, item_ion)
-
-        if len(cutoff_dict_array) != 0:
-            for key in cutoff_dict_array:
-                row = int(key)
-                peak_MNRatio = cutoff_dict_array[key]['peak_MNRatio']
-                peak_width = cutoff_dict_array[key]['peak_width']
-                cutoff_bin = cutoff_dict_array[key]['cutoff_bin']
-                cutoff_height = cutoff_dict_array[key]['cutoff_height']
-                cutoff_width = cutoff_dict_array[key]['cutoff_width']
-                if peak_MNRatio:
-                    item_peak = QTableWidgetItem()
-                    item_peak.setText(str(peak_MNRatio))
-                    self.tableWidget.setItem(row, 1, item_peak)
-                if peak_width:
-                    item_peak = QTableWidgetItem()
-                    item_peak.setText(str(peak_width))
-                    self.tableWidget.setItem(row, 2, item_peak)
-                if cutoff_bin:
-                    item_cutoff_bin = QTableWidgetItem()
-                    item_cutoff_bin.setText(str(cutoff_bin))
-                    self.tableWidget.setItem(row, 3, item_cutoff_bin)
-                if cutoff_height:
-                    item_cutoff_height = QTableWidgetItem()
-                    item_cutoff_height.setText(str(cutoff_height))
-                    self.tableWidget.setItem(row, 4, item_cutoff_height)
-                if cutoff_width:
-                    item_cutoff_width = QTableWidgetItem()
-                    item_cutoff_width.setText(str(cutoff_width))
-                    self.tableWidget.setItem(row, 5, item_cutoff_width)
+        self.model.refresh()
 
     def showEvent(self, event):
         super(InputElementTable, self).showEvent(event)
@@ -528,20 +870,22 @@ class InputElementTable(Ui_InputElementTable.Ui_Form, QDialog):
         self.cell_clicked = True
         self.row = row
         self.col = column
-        self.item = self.tableWidget.itemAt(row, column)
+        self.item = self.model.index(row, column)
+
+    def index_was_clicked(self, index):
+        self.cell_was_clicked(index.row(), index.column())
 
     def eventFilter(self, source: QtCore.QObject, event: QtCore.QEvent) -> bool:
         if event.type() == QEvent.MouseButtonDblClick:
             for key in element_dict:
                 element_dict[key] = []
 
-            headertext = self.tableWidget.horizontalHeaderItem(self.col).text()
+            headertext = self.model.headerData(self.col, Qt.Horizontal)
             if headertext == 'ION' and self.cell_clicked:
                 self.PeriodicTableCustom = PeriodicTableCustom()
-                if self.tableWidget.item(self.row, 0):
-                    already_ion = self.tableWidget.item(self.row, 0).text()
-                    if already_ion:
-                        self.PeriodicTableCustom.lineEdit_3.setText(already_ion)
+                already_ion = self.model.data(self.model.index(self.row, 0))
+                if already_ion:
+                    self.PeriodicTableCustom.lineEdit_3.setText(already_ion)
 
                 self.PeriodicTableCustom.curr_row = self.row
                 if self.PeriodicTableCustom.exec() == 1:
@@ -552,17 +896,7 @@ class InputElementTable(Ui_InputElementTable.Ui_Form, QDialog):
                     element_dict_array[str(self.row)]['num'] = element_dict['num']
                     element_dict_array[str(self.row)]['mass'] = element_dict['mass']
                     element_dict_array[str(self.row)]['charge'] = element_dict['charge']
-
-                    text = ''
-                    for i in range(len(element_dict['ion'])):
-                        text = text + str(element_dict['ion'][i]) + common.subscript(str(element_dict['num'][i]))
-                    if text:
-                        charge = str(element_dict['charge'][0])
-                        charge = '(' + charge + ')'
-                        text = text + charge
-                    item = QTableWidgetItem()
-                    item.setText(text)
-                    self.tableWidget.setItem(self.row, self.col, item)
+                    self.model.refreshRow(self.row)
 
         return super(InputElementTable, self).eventFilter(source, event)
 
@@ -608,6 +942,7 @@ class MonoLayerDialog(Ui_MonoLayer.Ui_Dialog, QDialog):
         self.setupUi(self)
 
         self.hdf_file = None
+        self.dataset_handle = None
         self.df_apt = None
         self.df_apt_layer = None
         self.widget_window = None
@@ -647,6 +982,11 @@ class MonoLayerDialog(Ui_MonoLayer.Ui_Dialog, QDialog):
         # Buttons
         self.pushButton_2.clicked.connect(self.plot_3d, False)  # Plot the APT data in 3D
         self.pushButton_3.clicked.connect(self.input_file)  # Input H5 file
+        # the dataset mapped in the main window is opened from the shared store, without an HDF file
+        self.pushButton_current = QPushButton("Current Dataset")
+        self.pushButton_current.setToolTip("Analyse the dataset mapped in the main window")
+        self.gridLayout_2.addWidget(self.pushButton_current, 0, 1, 1, 1)
+        self.pushButton_current.clicked.connect(lambda: self.input_file(current=True))
         self.pushButton_4.clicked.connect(self.plot_plane)  # Plot the plane based on given miller indices (and d)
         self.pushButton_11.clicked.connect(self.plot_DBScan)  # Scatter plot the ions after doing DBScan
         self.pushButton_5.clicked.connect(self.find_layers)  # Start finding layers by travelling along plane direction
@@ -662,13 +1002,18 @@ class MonoLayerDialog(Ui_MonoLayer.Ui_Dialog, QDialog):
         self.widget.canvas = FigureCanvas(self.widget.fig)
         self.widget.axes = self.widget.fig.add_subplot(111, projection='3d')
 
+    # Releases the shared dataset when the dialog is closed
+    def done(self, result):
+        datastore.release_dataset(self.dataset_handle)
+        self.dataset_handle = None
+        super(MonoLayerDialog, self).done(result)
+
     # The below function is used to read the H5 file containing binned (mapped) apt data for mono-layer analysis
-    def input_file(self):
-        file = QFileDialog.getOpenFileName(self, 'Select HDF File"',
-                                           os.getcwd(), "HDF files (*.h5)")
+    def input_file(self, current=False):
         try:
-            self.hdf_file = file[0]
-            self.df_apt = pd.read_hdf(self.hdf_file)
+            handle, self.hdf_file, self.df_apt = common.input_dataset(self, current, monolayer_columns)
+            datastore.release_dataset(self.dataset_handle)
+            self.dataset_handle = handle
             self.pushButton_2.setEnabled(True)
             self.pushButton.setEnabled(True)
 
@@ -1203,19 +1548,19 @@ class MonoLayerDialog(Ui_MonoLayer.Ui_Dialog, QDialog):
                             if ion_text in self.df_apt['ION'].values:
                                 df1 = df_layer[(df_layer['ION'].isin([ion_text]))]
                                 if df1.shape[0] > 0:
-                                    atom_count = len(df1.iloc[0]['ion'])
-                                    for num in range(atom_count):
-                                        ion_decomposed = df1.iloc[0]['ion'][num]
-                                        count = int(df1.iloc[0]['num'][num]) * df1.shape[0]
-
-                                        if str(ion_decomposed) in dict_decomposed:
-                                            dict_decomposed[str(ion_decomposed)] = int(
-                                                dict_decomposed[str(ion_decomposed)]) + int(count)
-                                        else:
-                                            dict_decomposed[str(ion_decomposed)] = int(count)
+                                    # atoms of the molecular ion per element, repeated symbols merged
+                                    for symbol, num in elements.formula_key(df1.iloc[0]['ion'], df1.iloc[0]['num']):
+                                        dict_decomposed[symbol] = dict_decomposed.get(symbol, 0) + num * df1.shape[0]
 
                         for sl_no, dict_ion in enumerate(dict_decomposed):
                             mydoc.add_paragraph("%i) Sum of %s = %i" % (sl_no + 1, dict_ion, dict_decomposed[dict_ion]))
+                        if dict_decomposed:
+                            # atomic and weight fractions from the standard atomic masses of the element table
+                            atoms = np.array(list(dict_decomposed.values()), dtype=np.float64)
+                            weights = atoms * elements.atomic_masses(list(dict_decomposed))
+                            for dict_ion, atom, weight in zip(dict_decomposed, atoms, weights):
+                                mydoc.add_paragraph("%s: %.2f at. %%, %.2f wt. %%" % (
+                                    dict_ion, 100 * atom / atoms.sum(), 100 * weight / weights.sum()))
                 mydoc.save(file[0])
 
         else:
@@ -1233,11 +1578,13 @@ class MonoLayerDialog(Ui_MonoLayer.Ui_Dialog, QDialog):
                 for i in range(1, self.no_layers + 1):
                     bool_columns.append('layer_' + str(i))
 
-                self.df_apt.loc[:, float_columns] = self.df_apt[float_columns].applymap(float)
-                self.df_apt.loc[:, int_columns] = self.df_apt[int_columns].applymap(int)
-                self.df_apt.loc[:, bool_columns] = self.df_apt[bool_columns].applymap(bool)
-
-                self.df_apt.to_hdf(file[0], key='df_apt_final', mode='w')
+                # only monolayer_columns were read for the analysis, the file gets all columns of the input
+                try:
+                    df_export = datastore.complete_frame(self.dataset_handle, self.df_apt)
+                except (ValueError, IOError, OSError) as error:
+                    common.show_message("The input dataset could not be read again: " + str(error))
+                    return
+                datastore.write_dataset(file[0], df_export, float_columns, int_columns, bool_columns)
 
         else:
             common.show_message("No valid data to output into the .h5 file")
@@ -1251,6 +1598,7 @@ class AbstractLayerDialog(Ui_AbstractLayer.Ui_Dialog, QDialog):
         self.setupUi(self)
 
         self.hdf_file = None
+        self.dataset_handle = None
         self.df_apt = None
         self.scatter3d = None
         self.scatter3d_noise_free = None
@@ -1281,22 +1629,87 @@ class AbstractLayerDialog(Ui_AbstractLayer.Ui_Dialog, QDialog):
         self.widget.canvas = FigureCanvas(self.widget.fig)
         self.widget.axes = self.widget.fig.add_subplot(111, projection='3d')
 
+        # Tiled DBScan splits the cloud into blocks with eps-wide halos and clusters them in a process pool
+        self.checkBox_tiled = QCheckBox(self.frame_2)
+        self.checkBox_tiled.setText("Tiled DBScan")
+        self.checkBox_tiled.setToolTip("Run DBScan block-wise in parallel (same labels, for clouds of millions of ions)")
+        self.gridLayout_4.addWidget(self.checkBox_tiled, 2, 1, 1, 2)
+
+        # One convex hull per DBScan cluster instead of a single hull around all noise-free ions
+        self.checkBox_cluster_hulls = QCheckBox(self.frame_2)
+        self.checkBox_cluster_hulls.setText("Hull per Cluster")
+        self.checkBox_cluster_hulls.setToolTip("Build a convex hull for every DBScan cluster label")
+        self.gridLayout_4.addWidget(self.checkBox_cluster_hulls, 5, 0, 1, 2)
+
+        # Isoconcentration surface of the layer element on a voxel grid, alternative to the convex hull
+        self.label_voxel = QLabel(self.frame_2)
+        self.label_voxel.setText("Voxel (nm)")
+        self.gridLayout_4.addWidget(self.label_voxel, 6, 0, 1, 1)
+        self.lineEdit_voxel = QLineEdit(self.frame_2)
+        self.lineEdit_voxel.setMaximumSize(QtCore.QSize(100, 30))
+        self.lineEdit_voxel.setText("1.0")
+        self.lineEdit_voxel.setToolTip("Edge length of the voxels used for the delocalized concentration")
+        self.gridLayout_4.addWidget(self.lineEdit_voxel, 6, 1, 1, 1)
+        self.label_iso = QLabel(self.frame_2)
+        self.label_iso.setText("Iso-conc. (%)")
+        self.gridLayout_4.addWidget(self.label_iso, 7, 0, 1, 1)
+        self.lineEdit_iso = QLineEdit(self.frame_2)
+        self.lineEdit_iso.setMaximumSize(QtCore.QSize(100, 30))
+        self.lineEdit_iso.setToolTip("Concentration of the layer element at the isosurface (atomic %)")
+        self.gridLayout_4.addWidget(self.lineEdit_iso, 7, 1, 1, 1)
+        self.pushButton_iso = QPushButton(self.frame_2)
+        self.pushButton_iso.setText("Plot Isosurface")
+        self.pushButton_iso.setToolTip("Plot the isoconcentration surface and classify the ions by the voxel grid")
+        self.pushButton_iso.setMaximumSize(QtCore.QSize(100, 30))
+        self.gridLayout_4.addWidget(self.pushButton_iso, 7, 2, 1, 1)
+
+        # Proxigram (concentration vs. signed distance) to the last calculated hull or isosurface
+        self.label_proxigram = QLabel(self.frame_2)
+        self.label_proxigram.setText("Proxigram bin (nm)")
+        self.gridLayout_4.addWidget(self.label_proxigram, 8, 0, 1, 1)
+        self.lineEdit_proxigram = QLineEdit(self.frame_2)
+        self.lineEdit_proxigram.setMaximumSize(QtCore.QSize(100, 30))
+        self.lineEdit_proxigram.setText("0.2")
+        self.lineEdit_proxigram.setToolTip("Width of the distance bins of the proxigram")
+        self.gridLayout_4.addWidget(self.lineEdit_proxigram, 8, 1, 1, 1)
+        self.pushButton_proxigram = QPushButton(self.frame_2)
+        self.pushButton_proxigram.setText("Proxigram")
+        self.pushButton_proxigram.setToolTip("Plot the ion concentrations against the distance to the interface")
+        self.pushButton_proxigram.setMaximumSize(QtCore.QSize(100, 30))
+        self.gridLayout_4.addWidget(self.pushButton_proxigram, 8, 2, 1, 1)
+
+        self.status_column = 'Status_convex_hull'
+        self.interface = None
+        self.df_proxigram = None
+
         self.pushButton_3.clicked.connect(self.input_file)  # Input H5 file
+        # the dataset mapped in the main window is opened from the shared store, without an HDF file
+        self.pushButton_current = QPushButton("Current Dataset")
+        self.pushButton_current.setToolTip("Analyse the dataset mapped in the main window")
+        self.gridLayout_2.addWidget(self.pushButton_current, 0, 1, 1, 1)
+        self.pushButton_current.clicked.connect(lambda: self.input_file(current=True))
         self.pushButton_2.clicked.connect(self.plot_3d, False)  # Plot the APT data in 3D
         self.pushButton_11.clicked.connect(self.plot_DBScan)  # Scatter plot the ions after doing DBScan
         self.pushButton_5.clicked.connect(self.plot_ConvexHull)  # Scatter plot the ions after doing DBScan
+        self.pushButton_iso.clicked.connect(self.plot_Isosurface)  # Plot the isoconcentration surface
+        self.pushButton_proxigram.clicked.connect(self.plot_Proxigram)  # Plot the proxigram of the interface
         self.pushButton_14.clicked.connect(self.decompose_list)  # give ions to decompose
         self.pushButton_16.clicked.connect(self.export_report)  # calculate and export final report as word docx
         self.pushButton_15.clicked.connect(self.export_hdf)  # export final dataframe as HDF file
 
+    # Releases the shared dataset when the dialog is closed
+    def done(self, result):
+        datastore.release_dataset(self.dataset_handle)
+        self.dataset_handle = None
+        super(AbstractLayerDialog, self).done(result)
+
     # The below function is used to read the H5 file containing binned (mapped) apt data for abstract-layer analysis
-    def input_file(self):
+    def input_file(self, current=False):
         # file = ['C://Users/arjun/Downloads/APT_Code/APT_Project/totaldata3_binned.h5']
-        file = QFileDialog.getOpenFileName(self, 'Select HDF File"',
-                                           os.getcwd(), "HDF files (*.h5)")
         try:
-            self.hdf_file = file[0]
-            self.df_apt = pd.read_hdf(self.hdf_file)
+            handle, self.hdf_file, self.df_apt = common.input_dataset(self, current)
+            datastore.release_dataset(self.dataset_handle)
+            self.dataset_handle = handle
             self.pushButton_2.setEnabled(True)
 
         except:
@@ -1447,8 +1860,11 @@ class AbstractLayerDialog(Ui_AbstractLayer.Ui_Dialog, QDialog):
                 self.remove_plots()
 
                 X = self.df_apt_layer[['X', 'Y', 'Z']].to_numpy()
-                db = DBSCAN(eps=EPSILON, min_samples=MIN_POINTS).fit(X)
-                labels = db.labels_
+                if self.checkBox_tiled.isChecked():
+                    labels = spatial.tiled_dbscan(X, EPSILON, MIN_POINTS)
+                else:
+                    db = DBSCAN(eps=EPSILON, min_samples=MIN_POINTS).fit(X)
+                    labels = db.labels_
                 self.df_apt_layer['DBSCAN_Label'] = labels.reshape(-1, 1)
 
                 if self.radioButton.isChecked():
@@ -1489,26 +1905,150 @@ class AbstractLayerDialog(Ui_AbstractLayer.Ui_Dialog, QDialog):
             else:
                 df_apt_layer_noise_free = self.df_apt_layer
 
+            self.status_column = 'Status_convex_hull'
             df_apt_layer_noise_free['Status_convex_hull'] = True
             points_not_noise = df_apt_layer_noise_free[['X', 'Y', 'Z']].values
-            hull = ConvexHull(points_not_noise)
-            deln = Delaunay(points_not_noise[hull.vertices])
 
             if self.df_apt is not None:
                 self.df_apt = common.bring_df_to_positive_coord(self.df_apt)
 
             df_apt_non_layer = self.df_apt[~self.df_apt['ION'].isin([self.ION])]
-
-            non_layer_points = df_apt_non_layer[['X', 'Y', 'Z']].to_numpy()
-            df_apt_non_layer['Status_convex_hull'] = deln.find_simplex(non_layer_points) >= 0
+            non_layer_x = df_apt_non_layer['X'].to_numpy()
+            non_layer_y = df_apt_non_layer['Y'].to_numpy()
+            non_layer_z = df_apt_non_layer['Z'].to_numpy()
+
+            if self.checkBox_cluster_hulls.isChecked() and 'DBSCAN_Label' in df_apt_layer_noise_free.columns:
+                labels = df_apt_layer_noise_free['DBSCAN_Label'].to_numpy()
+                hulls = spatial.cluster_hulls(points_not_noise, labels)
+                df_apt_layer_noise_free['Cluster_convex_hull'] = labels
+                cluster = spatial.points_in_cluster_hulls(hulls, non_layer_x, non_layer_y, non_layer_z)
+                df_apt_non_layer['Cluster_convex_hull'] = cluster
+                df_apt_non_layer['Status_convex_hull'] = cluster != -1
+                hull_vertices_simplices = [(hull['vertices'], hull['simplices']) for hull in hulls]
+            else:
+                hull = ConvexHull(points_not_noise)
+                df_apt_non_layer['Status_convex_hull'] = spatial.points_in_hull(hull, non_layer_x, non_layer_y,
+                                                                                non_layer_z)
+                hull_vertices_simplices = [(points_not_noise, hull.simplices)]
+
+            if hull_vertices_simplices:
+                offsets = np.cumsum([0] + [len(vertices) for vertices, _ in hull_vertices_simplices])
+                self.interface = (np.concatenate([vertices for vertices, _ in hull_vertices_simplices]),
+                                  np.concatenate([simplices + offset for (_, simplices), offset in
+                                                  zip(hull_vertices_simplices, offsets)]))
+            else:
+                self.interface = None
+            self.df_proxigram = None
 
             frames = [df_apt_layer_noise_free, df_apt_non_layer]
             self.df_apt_final = pd.concat(frames)
             self.Hull3d_lines = []
-            for s in hull.simplices:
-                x, y, z = points_not_noise[s, 0], points_not_noise[s, 1], points_not_noise[s, 2]
-                self.Hull3d_lines.append(self.widget.axes.plot(x, y, z, '--', c='green', alpha=0.1)[0])
-                self.widget.fig.canvas.draw()
+            for vertices, simplices in hull_vertices_simplices:
+                for s in simplices:
+                    x, y, z = vertices[s, 0], vertices[s, 1], vertices[s, 2]
+                    self.Hull3d_lines.append(self.widget.axes.plot(x, y, z, '--', c='green', alpha=0.1)[0])
+            self.widget.fig.canvas.draw()
+
+    # The below function calculates the isoconcentration surface of the layer element on a voxel grid
+    # Ions are classified by the delocalized concentration at their position, which also handles concave features
+    def plot_Isosurface(self):
+        if self.df_apt_layer is not None:
+            pattern_float = "^\s*\d+\.?\d*\s*$"
+            rex_pattern_float = re.compile(pattern_float)
+
+            voxel_size = None
+            iso_conc = None
+            if rex_pattern_float.match(self.lineEdit_voxel.text()) and float(self.lineEdit_voxel.text()) > 0:
+                voxel_size = float(self.lineEdit_voxel.text())
+            else:
+                common.show_message("a positive float value is expected for the voxel size")
+
+            if rex_pattern_float.match(self.lineEdit_iso.text()) and 0 < float(self.lineEdit_iso.text()) < 100:
+                iso_conc = float(self.lineEdit_iso.text())
+            else:
+                common.show_message("a value between 0 and 100 (%) is expected for the isoconcentration")
+
+            if voxel_size is None or iso_conc is None:
+                return
+
+            if self.widget.axes and self.Hull3d_lines:
+                for layer in self.Hull3d_lines:
+                    layer.remove()
+                self.Hull3d_lines = []
+
+            if 'DBSCAN_Label' in self.df_apt_layer.columns:
+                df_apt_layer_noise = self.df_apt_layer[self.df_apt_layer['DBSCAN_Label'] == -1]
+                df_apt_layer_noise_free = self.df_apt_layer[self.df_apt_layer['DBSCAN_Label'] != -1]
+            else:
+                df_apt_layer_noise = self.df_apt_layer.iloc[0:0]
+                df_apt_layer_noise_free = self.df_apt_layer
+
+            self.df_apt = common.bring_df_to_positive_coord(self.df_apt)
+            df_apt_iso = self.df_apt[~self.df_apt.index.isin(df_apt_layer_noise.index)]
+            x = df_apt_iso['X'].to_numpy()
+            y = df_apt_iso['Y'].to_numpy()
+            z = df_apt_iso['Z'].to_numpy()
+            is_solute = df_apt_iso.index.isin(df_apt_layer_noise_free.index)
+
+            grid = spatial.concentration_grid(x, y, z, is_solute, voxel_size)
+            vertices, faces = spatial.isosurface(grid, iso_conc / 100.0)
+            if vertices is None:
+                common.show_message("The isoconcentration value is not crossed anywhere inside the dataset")
+                return
+
+            self.status_column = 'Status_isosurface'
+            df_apt_iso['Concentration_isosurface'] = spatial.voxel_concentration(grid, x, y, z)
+            df_apt_iso['Status_isosurface'] = df_apt_iso['Concentration_isosurface'] >= iso_conc / 100.0
+            self.df_apt_final = df_apt_iso
+            self.interface = (vertices, faces)
+            self.df_proxigram = None
+
+            self.Hull3d_lines = [self.widget.axes.plot_trisurf(vertices[:, 0], vertices[:, 1], faces, vertices[:, 2],
+                                                               color='green', alpha=0.2, linewidth=0)]
+            self.widget.fig.canvas.draw()
+
+        else:
+            common.show_message("Plot the layer elements once before calculating the isosurface")
+
+    # The below function bins the ion species by their signed distance to the interface (hull or isosurface)
+    # Distances are positive inside the abstract layer and the profiles are given in atomic %
+    def plot_Proxigram(self):
+        if self.df_apt_final is not None and self.interface is not None:
+            pattern_float = "^\s*\d+\.?\d*\s*$"
+            rex_pattern_float = re.compile(pattern_float)
+            bin_text = self.lineEdit_proxigram.text()
+            if rex_pattern_float.match(bin_text) and float(bin_text) > 0:
+                bin_width = float(bin_text)
+            else:
+                common.show_message("a positive float value is expected for the proxigram bin")
+                return
+
+            species, ion_names = pd.factorize(self.df_apt_final['ION'])
+            vertices, faces = self.interface
+            edges, counts = spatial.proxigram(vertices, faces, self.df_apt_final['X'].to_numpy(),
+                                              self.df_apt_final['Y'].to_numpy(), self.df_apt_final['Z'].to_numpy(),
+                                              self.df_apt_final[self.status_column].to_numpy(dtype=bool),
+                                              species, len(ion_names), bin_width, proxigram_max_distance)
+
+            total = counts.sum(axis=1)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                concentration = 100.0 * counts / total[:, None]
+            self.df_proxigram = pd.DataFrame(concentration, columns=[str(ion) for ion in ion_names])
+            self.df_proxigram.insert(0, 'distance', (edges[:-1] + edges[1:]) / 2.0)
+            self.df_proxigram.insert(1, 'counts', total)
+
+            plt.figure(figsize=(10, 10), dpi=80, facecolor='w', edgecolor='k')
+            plt.title('Proxigram')
+            for ion in self.df_proxigram.columns[2:]:
+                plt.plot(self.df_proxigram['distance'], self.df_proxigram[ion], label=ion)
+            plt.axvline(0, color='grey', linestyle='--')
+            plt.xlabel("Distance to interface (nm)")
+            plt.ylabel("Concentration (at. %)")
+            plt.legend()
+            plt.show()
+
+        else:
+            common.show_message("Calculate a convex hull or an isosurface before the proxigram")
 
     # The following function is for optional entry where few input ions maybe specified to be decomposed in the report
     def decompose_list(self):
@@ -1528,7 +2068,7 @@ class AbstractLayerDialog(Ui_AbstractLayer.Ui_Dialog, QDialog):
             if len(file[0]) > 1:
                 mydoc = docx.Document()
                 if self.df_apt_final.shape[0] > 2:
-                    df_layer = self.df_apt_final[self.df_apt_final['Status_convex_hull'] == True]
+                    df_layer = self.df_apt_final[self.df_apt_final[self.status_column] == True]
                     df_ions = df_layer['ION'].value_counts().to_frame().reset_index()
                     df_ions = df_ions.rename(columns={"index": "ION", "ION": "counts"})
 
@@ -1553,6 +2093,24 @@ class AbstractLayerDialog(Ui_AbstractLayer.Ui_Dialog, QDialog):
 
                     table.style = 'Table Grid'
 
+                    if 'Cluster_convex_hull' in self.df_apt_final.columns:
+                        df_cluster_ions = df_layer.groupby(['Cluster_convex_hull', 'ION']).size().reset_index(
+                            name='counts')
+                        mydoc.add_paragraph("Ion counts inside the convex hull of each %s cluster" % self.ION)
+                        table = mydoc.add_table(rows=1, cols=3)
+                        table_row = table.rows[0].cells
+                        table_row[0].text = 'cluster'
+                        table_row[1].text = 'ION'
+                        table_row[2].text = 'counts'
+
+                        for _, row in df_cluster_ions.iterrows():
+                            table_row = table.add_row().cells
+                            table_row[0].text = str(int(row['Cluster_convex_hull']))
+                            table_row[1].text = str(row['ION'])
+                            table_row[2].text = str(row['counts'])
+
+                        table.style = 'Table Grid'
+
                     dict_decomposed = {}
                     if self.df_decompose_el is not None:
                         mydoc.add_paragraph("The input Decompose ions are: %s" % str(self.df_decompose_el))
@@ -1561,20 +2119,24 @@ class AbstractLayerDialog(Ui_AbstractLayer.Ui_Dialog, QDialog):
                             if ion_text in self.df_apt_final['ION'].values:
                                 df1 = df_layer[(df_layer['ION'].isin([ion_text]))]
                                 if df1.shape[0] > 0:
-                                    atom_count = len(df1.iloc[0]['ion'])
-                                    for num in range(atom_count):
-                                        ion_decomposed = df1.iloc[0]['ion'][num]
-                                        count = int(df1.iloc[0]['num'][num]) * df1.shape[0]
-
-                                        if str(ion_decomposed) in dict_decomposed:
-                                            dict_decomposed[str(ion_decomposed)] = int(
-                                                dict_decomposed[str(ion_decomposed)]) + int(count)
-                                        else:
-                                            dict_decomposed[str(ion_decomposed)] = int(count)
+                                    # atoms of the molecular ion per element, repeated symbols merged
+                                    for symbol, num in elements.formula_key(df1.iloc[0]['ion'], df1.iloc[0]['num']):
+                                        dict_decomposed[symbol] = dict_decomposed.get(symbol, 0) + num * df1.shape[0]
 
                         for sl_no, dict_ion in enumerate(dict_decomposed):
                             mydoc.add_paragraph(
                                 "%i) Sum of %s = %i" % (sl_no + 1, dict_ion, dict_decomposed[dict_ion]))
+                        if dict_decomposed:
+                            # atomic and weight fractions from the standard atomic masses of the element table
+                            atoms = np.array(list(dict_decomposed.values()), dtype=np.float64)
+                            weights = atoms * elements.atomic_masses(list(dict_decomposed))
+                            for dict_ion, atom, weight in zip(dict_decomposed, atoms, weights):
+                                mydoc.add_paragraph("%s: %.2f at. %%, %.2f wt. %%" % (
+                                    dict_ion, 100 * atom / atoms.sum(), 100 * weight / weights.sum()))
+
+                    if self.df_proxigram is not None:
+                        mydoc.add_paragraph("Proxigram: concentration (at. %) against distance to the interface (nm)")
+                        mydoc.add_paragraph(self.df_proxigram.round(3).to_string())
                 mydoc.save(file[0])
 
         else:
@@ -1585,18 +2147,12 @@ class AbstractLayerDialog(Ui_AbstractLayer.Ui_Dialog, QDialog):
         if self.df_apt_final is not None and self.df_apt_final.shape[0] > 0:
             file = QFileDialog.getSaveFileName(self, 'Select/Create HDF File"', os.getcwd(), "HDF files (*.h5)")
             if len(file[0]) > 1:
-                float_columns = ['X', 'Y', 'Z', 'MN_Ratio', 'peak_MNRatio', 'peak_max_cutoff_width',
-                                 'Status_convex_hull']
+                float_columns = ['X', 'Y', 'Z', 'MN_Ratio', 'peak_MNRatio', 'peak_max_cutoff_width']
                 int_columns = ['peak_no', 'XYZ_total_count']
-                bool_columns = []
-                for i in range(1, self.no_layers + 1):
-                    bool_columns.append('layer_' + str(i))
+                # the layer status of the convex hull or isosurface detection
+                bool_columns = [self.status_column]
 
-                self.df_apt_final.loc[:, float_columns] = self.df_apt_final[float_columns].applymap(float)
-                self.df_apt_final.loc[:, int_columns] = self.df_apt_final[int_columns].applymap(int)
-                self.df_apt_final.loc[:, bool_columns] = self.df_apt_final[bool_columns].applymap(bool)
-
-                self.df_apt_final.to_hdf(file[0], key='df_apt_final', mode='w')
+                datastore.write_dataset(file[0], self.df_apt_final, float_columns, int_columns, bool_columns)
 
         else:
             common.show_message("No valid data to output into the .h5 file")
@@ -1610,6 +2166,7 @@ class SRODialog(Ui_SRO.Ui_Dialog, QDialog):
         self.setupUi(self)
 
         self.df_apt = None
+        self.dataset_handle = None
         self.poscar = None
         self.input_radius_table = None
         self.voxel_status = False
@@ -1633,6 +2190,11 @@ class SRODialog(Ui_SRO.Ui_Dialog, QDialog):
         self.PeriodicTableCustom = PeriodicTableCustom()
 
         self.pushButton_1.clicked.connect(self.input_file)  # Input H5 file
+        # the dataset mapped in the main window is opened from the shared store, without an HDF file
+        self.pushButton_current = QPushButton("Current Dataset")
+        self.pushButton_current.setToolTip("Analyse the dataset mapped in the main window")
+        self.gridLayout_2.addWidget(self.pushButton_current, 0, 2, 1, 1)
+        self.pushButton_current.clicked.connect(lambda: self.input_file(current=True))
         self.pushButton_4.clicked.connect(self.input_POSCAR)  # Input POSCAR file
         self.pushButton_5.clicked.connect(self.use_nearest_neighbour_chart)  # use the radius based on NN chart
         self.pushButton_6.clicked.connect(self.use_nearest_neighbour_3DMF)  # use the radius based on 3DMF chart
@@ -1650,14 +2212,19 @@ class SRODialog(Ui_SRO.Ui_Dialog, QDialog):
         self.pushButton_9.clicked.connect(self.Calculate_SRO)  # Subtract a Cl ion from periodic table
         self.pushButton_15.clicked.connect(self.plot_GMSRO)  # To plot the final GM-SRO plot
 
+    # Releases the shared dataset when the dialog is closed
+    def done(self, result):
+        datastore.release_dataset(self.dataset_handle)
+        self.dataset_handle = None
+        super(SRODialog, self).done(result)
+
     # The function used to read the H5 file containing binned (mapped) apt data
-    def input_file(self):
+    def input_file(self, current=False):
         # file = ['C://Users/arjun/Downloads/APT_Code/APT_Project/totaldata2_binned.h5']
-        file = QFileDialog.getOpenFileName(self, 'Select HDF File"',
-                                           os.getcwd(), "HDF files (*.h5)")
         try:
-            self.hdf_file = file[0]
-            self.df_apt = pd.read_hdf(self.hdf_file)
+            handle, self.hdf_file, self.df_apt = common.input_dataset(self, current, sro_columns)
+            datastore.release_dataset(self.dataset_handle)
+            self.dataset_handle = handle
             self.df_apt['status_Bj'] = None
             self.df_apt['status_Cl'] = None
             self.df_apt = common.bring_df_to_positive_coord(self.df_apt)
@@ -1874,6 +2441,10 @@ class SRODialog(Ui_SRO.Ui_Dialog, QDialog):
     # Function to display chosen radius chart and make manual changes if needed
     def use_manual_critical_radius(self):
         self.input_radius_table = InputElementTable()
+        # the radius table is a plain item table, the ion rows of the dialog are not used
+        self.input_radius_table.tableView.setVisible(False)
+        self.input_radius_table.tableWidget.setVisible(True)
+        self.input_radius_table.tableWidget.setRowCount(self.max_shell)
         self.input_radius_table.tableWidget.setColumnCount(2)
         self.input_radius_table.tableWidget.setHorizontalHeaderItem(0, QTableWidgetItem("Radius"))
         self.input_radius_table.tableWidget.setHorizontalHeaderItem(1, QTableWidgetItem("No: of Neighbours"))
@@ -1882,8 +2453,10 @@ class SRODialog(Ui_SRO.Ui_Dialog, QDialog):
         header.setSectionResizeMode(0, QHeaderView.ResizeToContents)
         self.input_radius_table.pushButton_2.setVisible(False)
         self.input_radius_table.pushButton.setVisible(False)
-        self.input_radius_table.tableWidget.cellClicked.disconnect()
-        self.input_radius_table.tableWidget.cellDoubleClicked.disconnect()
+        self.input_radius_table.pushButton_detect.setVisible(False)
+        self.input_radius_table.pushButton_isotopes.setVisible(False)
+        self.input_radius_table.pushButton_sweep.setVisible(False)
+        self.input_radius_table.tableView.viewport().removeEventFilter(self.input_radius_table)
 
         for row in range(self.max_shell):
             item_rad = QTableWidgetItem()
@@ -2378,6 +2951,7 @@ class CompositionMapDialog(Ui_CompositionMap.Ui_Dialog, QDialog):
         self.pushButton_3.setEnabled(False)
         self.df_apt_final = None
         self.hdf_file = None
+        self.dataset_handle = None
         self.df_apt = None
         self.decompose_el = None
         self.ion_dict = None
@@ -2408,6 +2982,11 @@ class CompositionMapDialog(Ui_CompositionMap.Ui_Dialog, QDialog):
         self.progressBar.setValue(self.completed)
 
         self.pushButton_1.clicked.connect(self.input_file)  # Input H5 file
+        # the dataset mapped in the main window is opened from the shared store, without an HDF file
+        self.pushButton_current = QPushButton("Current Dataset")
+        self.pushButton_current.setToolTip("Analyse the dataset mapped in the main window")
+        self.gridLayout_6.addWidget(self.pushButton_current, 0, 1, 1, 1)
+        self.pushButton_current.clicked.connect(lambda: self.input_file(current=True))
         self.pushButton_5.clicked.connect(self.add_ion)  # Add an ion to decompose list
         self.pushButton_6.clicked.connect(self.subtract_ion)  # subtract an ion from decompose list
         self.pushButton_7.clicked.connect(self.add_el)  # Add an element to binary plot list
@@ -2415,25 +2994,32 @@ class CompositionMapDialog(Ui_CompositionMap.Ui_Dialog, QDialog):
         self.pushButton_3.clicked.connect(self.cluster_analysis)  # calculate the composition based on cluster analysis
         self.pushButton_4.clicked.connect(self.plot_apt)  # plot the APT based on binary elements
 
+    # Releases the shared dataset when the dialog is closed
+    def done(self, result):
+        datastore.release_dataset(self.dataset_handle)
+        self.dataset_handle = None
+        super(CompositionMapDialog, self).done(result)
+
     # The function used to read the H5 file containing binned (mapped) apt data
-    def input_file(self):
+    def input_file(self, current=False):
         self.listWidget.clear()
         self.listWidget_2.clear()
         self.listWidget_3.clear()
         self.listWidget_4.clear()
         # file = ['C:/Users/arjun/Downloads/APT_Code/APT_Project/Output_Analyzed_H5/Cooxide_binned.h5']
-        file = QFileDialog.getOpenFileName(self, 'Select HDF File"',
-                                           os.getcwd(), "HDF files (*.h5)")
 
         try:
-            self.hdf_file = file[0]
-            self.df_apt = pd.read_hdf(self.hdf_file)
+            handle, self.hdf_file, self.df_apt = common.input_dataset(self, current)
+            datastore.release_dataset(self.dataset_handle)
+            self.dataset_handle = handle
             self.df_apt = common.bring_df_to_positive_coord(self.df_apt)
-            self.df_apt['status_decompose'] = None
+            # all columns are read, a file exported by this dialog already has the columns below as shared read-only
+            # arrays, so they are replaced instead of written into
+            datastore.derive_column(self.df_apt, 'status_decompose', np.full(len(self.df_apt), None, dtype=object))
             # each time the previous cluster analysis is replaced, better book-keeping can be optionally added for reuse
             if 'cluster_centre' in self.df_apt.columns:
                 del self.df_apt['cluster_centre']
-            self.df_apt['cluster_id'] = 0
+            datastore.derive_column(self.df_apt, 'cluster_id', np.zeros(len(self.df_apt), dtype=np.int64))
             self.lcdNumber.setDigitCount(10)
             self.lcdNumber.display(0)
             self.lineEdit_3.setText('3')
@@ -2541,8 +3127,8 @@ class CompositionMapDialog(Ui_CompositionMap.Ui_Dialog, QDialog):
             NN, num_origins, leaf, critical_radius = self.input_parameters()
 
             self.decompose_el = [str(self.listWidget_2.item(i).text()) for i in range(self.listWidget_2.count())]
-            self.df_apt['status_decompose'] = self.df_apt['ION'].apply(
-                lambda x: any([i in x for i in self.decompose_el]))
+            datastore.derive_column(self.df_apt, 'status_decompose', self.df_apt['ION'].apply(
+                lambda x: any([i in x for i in self.decompose_el])))
             df_decompose = self.df_apt[self.df_apt['status_decompose'] == True]
 
             if num_origins > self.lcdNumber.value():
@@ -2794,6 +3380,9 @@ class MainWindow(Ui_APTMainWindow.Ui_MainWindow, QMainWindow):
         self.df_apt = None
         self.df_el = None
         self.df_apt_final = None
+        self.spectrum_index = None
+        # classified range rows of start_binning, keyed by the dataset and the row parameters
+        self.range_cache = OrderedDict()
 
         # Self Variables for functions
         self.mat_file = None
@@ -2809,6 +3398,11 @@ class MainWindow(Ui_APTMainWindow.Ui_MainWindow, QMainWindow):
         self.actionGM_SRO.triggered.connect(self.GM_SRO)
         self.actionComposition_Mapping.triggered.connect(self.Composition_Mapping)
         self.actionExit.triggered.connect(sys.exit)
+        # hit rate and memory of the datasets the analysis dialogs read from files
+        self.actionDataset_Cache = QAction("Dataset Cache", self)
+        self.actionDataset_Cache.triggered.connect(self.dataset_cache)
+        self.menuAnalysis.addSeparator()
+        self.menuAnalysis.addAction(self.actionDataset_Cache)
         self.start_button_status()
         self.button_operations()
 
@@ -2836,6 +3430,8 @@ class MainWindow(Ui_APTMainWindow.Ui_MainWindow, QMainWindow):
         """   set status of the buttons when program starts before input_file """
 
         self.tableView.horizontalHeader().setStretchLastSection(True)
+        # fixed row heights let the view scroll through millions of rows without measuring them
+        self.tableView.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
         self.btn_view_df.setEnabled(False)
         self.btn_plot_hist.setEnabled(False)
         self.btn_start_bin.setEnabled(False)
@@ -2851,6 +3447,8 @@ class MainWindow(Ui_APTMainWindow.Ui_MainWindow, QMainWindow):
         try:
             self.mat_file = file[0]
             self.df_apt = common.read_data(self.mat_file)
+            # sorted MN_Ratio and cumulative counts, histograms and range counts are looked up from here
+            self.spectrum_index = spectrum.build_spectrum_index(self.df_apt["MN_Ratio"])
             self.start_button_status()
             self.btn_view_df.setEnabled(True)
             self.btn_plot_hist.setEnabled(True)
@@ -2865,6 +3463,15 @@ class MainWindow(Ui_APTMainWindow.Ui_MainWindow, QMainWindow):
         self.composition_map = CompositionMapDialog()
         self.composition_map.show()
 
+    # Shows the state of the dataset cache shared by the analysis dialogs
+    def dataset_cache(self):
+        report = datastore.cache_report()
+        common.show_message("Dataset cache: %d datasets, hit rate %.0f %% (%d hits, %d memory mapped hits, %d misses)\n"
+                            "%.1f MB resident, %.1f MB memory mapped, %.1f MB shared by the main window" % (
+                                report['datasets'], 100 * report['hit_rate'], report['hits'], report['mapped_hits'],
+                                report['misses'], report['resident_bytes'] / 1e6, report['mapped_bytes'] / 1e6,
+                                report['shared_bytes'] / 1e6))
+
     # The function that calls Mono layer window to do the analysis part and get ion counts
     def Mono_Layer_Analysis(self):
         self.mono_layer = MonoLayerDialog()
@@ -2881,72 +3488,38 @@ class MainWindow(Ui_APTMainWindow.Ui_MainWindow, QMainWindow):
         self.SRO.show()
 
     # To export the final binned and mapped apt dataset as hdf file for further analysis
+    # (typed columns, species as integer codes with a lookup table, compressed table format)
     def export_hdf(self):
+        if self.df_apt_final is None or self.df_apt_final.shape[0] == 0:
+            common.show_message("No valid data to output into the .h5 file")
+            return
         file = QFileDialog.getSaveFileName(self, 'Select/Create HDF File"',
                                            os.getcwd(), "HDF files (*.h5)")
         if len(file[0]) > 1:
             float_columns = ['X', 'Y', 'Z', 'MN_Ratio', 'peak_MNRatio', 'peak_max_cutoff_width']
             int_columns = ['peak_no', 'XYZ_total_count']
 
-            self.df_apt_final.loc[:, float_columns] = self.df_apt_final[float_columns].applymap(float)
-            self.df_apt_final.loc[:, int_columns] = self.df_apt_final[int_columns].applymap(int)
+            datastore.write_dataset(file[0], self.df_apt_final, float_columns, int_columns)
 
-            self.df_apt_final.to_hdf(file[0], key='df_apt_final', mode='w')
+    # Shows a dataframe in the table view of the main window (no copy, only the visible cells are formatted)
+    def show_table(self, df):
+        self.model = ArrayTableModel(df)
+        self.tableView.setModel(self.model)
+        self.tableView.horizontalHeader().setSectionResizeMode(QHeaderView.Interactive)
+        self.tableView.resizeColumnsToContents()
+        self.tableView.horizontalHeader().setStretchLastSection(True)
 
     # To view the columns of the original file input
     def view_df_apt(self):
-        self.df_apt = common.read_data(self.mat_file)
-        # self.model = DataFrameModel(self.df_apt.tail())
-
-        self.model = QStandardItemModel()
-        table_title = list(self.df_apt.columns.values)
-        table_title.insert(0, "row_idx")
-        self.model.setHorizontalHeaderLabels(table_title)
-
-        index, row_data = self.df_apt.tail().index.values, self.df_apt.tail().to_numpy()
-        data = np.hstack((index.reshape(len(index), 1), row_data))
-
-        for line in data:
-            row = []
-            for name in line:
-                item = QStandardItem(str(name))
-                item.setEditable(False)
-                row.append(item)
-            self.model.appendRow(row)
-
-        self.tableView.setModel(self.model)
-        for i in range(self.df_apt.shape[1]):
-            self.tableView.horizontalHeader().setSectionResizeMode(i, QHeaderView.ResizeToContents)
+        self.show_table(self.df_apt)
 
     # To view the columns of the final binned and mapped apt dataset
     def view_df_apt_final(self):
-        # self.model = DataFrameModel(self.df_apt_final.head())
-
-        self.model = QStandardItemModel()
-        table_title = list(self.df_apt_final.columns.values)
-        table_title.insert(0, "row_idx")
-        self.model.setHorizontalHeaderLabels(table_title)
-        index, row_data = self.df_apt_final.tail().index.values, self.df_apt_final.tail().to_numpy()
-        data = np.hstack((index.reshape(len(index), 1), row_data))
-
-        for line in data:
-            row = []
-            for name in line:
-                item = QStandardItem(str(name))
-                item.setEditable(False)
-                row.append(item)
-            self.model.appendRow(row)
-
-        self.tableView.setModel(self.model)
-        for i in range(self.df_apt.shape[1]):
-            self.tableView.horizontalHeader().setSectionResizeMode(i, QHeaderView.ResizeToContents)
+        self.show_table(self.df_apt_final)
 
     # To view the final columns of all elements that were provided as input from the table
     def view_df_el(self):
-        self.model = DataFrameModel(self.df_el)
-        self.tableView.setModel(self.model)
-        for i in range(self.df_el.shape[1]):
-            self.tableView.horizontalHeader().setSectionResizeMode(i, QHeaderView.ResizeToContents)
+        self.show_table(self.df_el)
 
     # To plot the histogram data given the start and end MN ratio, helps in checking for peaks
     def plot_hist(self):
@@ -2978,22 +3551,66 @@ class MainWindow(Ui_APTMainWindow.Ui_MainWindow, QMainWindow):
             show_message("Enter a valid bin size (0 - 1)")
 
         else:
-            num_bins = int((1 / bins) * np.max(self.df_apt["MN_Ratio"]))
-            _freq, _bins = np.histogram(self.df_apt["MN_Ratio"], bins=num_bins)
-            df_apt_hist = pd.DataFrame(list(zip(_bins[:-1], _bins[:-1], _freq)),
-                                       columns=['bin_lower', 'bin_upper', 'freq'])
-
-            subset_df_apt_hist = df_apt_hist[df_apt_hist["bin_lower"] > float(xlim_left)]
-            subset_df_apt_hist = subset_df_apt_hist[subset_df_apt_hist["bin_lower"] < float(xlim_right)]
-
-            self.plot_window = HistogramWindow(subset_df_apt_hist)
+            self.plot_window = HistogramWindow(self.spectrum_index, bins, xlim_left, xlim_right)
             self.plot_window.show()
 
     # Open the input element table to input the element information and cutoff values
     def input_elements(self):
-        self.input_table = InputElementTable()
+        self.input_table = InputElementTable(self.spectrum_index, self.mat_file)
         self.input_table.show()
 
+    # Splits the counts of overlapping peaks between the ions of the table with a NNLS fit of their isotope patterns.
+    # Returns the deconvolved counts per row of df_el, peaks that no isotope of the table explains keep their counts
+    def deconvolve_peaks(self, dict_peak_min_max_count):
+        peak_ids = sorted(dict_peak_min_max_count.keys())
+        low = np.array([dict_peak_min_max_count[key][1] for key in peak_ids], dtype=np.float64)
+        high = np.array([dict_peak_min_max_count[key][2] for key in peak_ids], dtype=np.float64)
+        counts = np.array([dict_peak_min_max_count[key][4] for key in peak_ids], dtype=np.float64)
+        peak_pos = {key: i for i, key in enumerate(peak_ids)}
+
+        species_keys = [(elements.formula_key(row['ion'], row['num']), elements.charge_number(row['charge']))
+                        for _, row in self.df_el.iterrows()]
+        species = {key: i for i, key in enumerate(dict.fromkeys(species_keys))}
+        try:
+            patterns = [elements.isotope_pattern([symbol for symbol, _ in formula], [num for _, num in formula], charge)
+                        for formula, charge in species]
+        except KeyError as error:
+            common.show_message("Peaks were not deconvolved: " + str(error))
+            return self.df_el['XYZ_total_count'].values
+
+        design = spectrum.overlap_design(low, high, patterns)
+        _totals, apportioned = spectrum.deconvolve_overlaps(design, counts)
+
+        rows_per_peak = self.df_el['peak_id'].value_counts()
+        deconvolved = np.zeros(self.df_el.shape[0])
+        for i, (peak_id, key) in enumerate(zip(self.df_el['peak_id'].values, species_keys)):
+            if pd.isnull(peak_id) or peak_id not in peak_pos:
+                continue
+            p = peak_pos[peak_id]
+            if design[p].any():
+                deconvolved[i] = apportioned[p, species[key]]
+            else:
+                deconvolved[i] = counts[p] / rows_per_peak[peak_id]
+        return np.round(deconvolved, 1)
+
+    # Adds the background under every ranged peak (background model of the whole spectrum in sqrt(MN_Ratio) space), the
+    # background subtracted count, the peak to background ratio and the detection limit (counts) to df_el
+    def correct_background(self, dict_peak_min_max_count):
+        peak_ids = sorted(dict_peak_min_max_count.keys())
+        low = np.array([dict_peak_min_max_count[key][1] for key in peak_ids], dtype=np.float64)
+        high = np.array([dict_peak_min_max_count[key][2] for key in peak_ids], dtype=np.float64)
+        counts = np.array([dict_peak_min_max_count[key][4] for key in peak_ids], dtype=np.float64)
+        correction = spectrum.background_correction(self.spectrum_index, low, high, counts)
+
+        peak_pos = pd.Series(np.arange(len(peak_ids)), index=peak_ids)
+        rows = peak_pos.reindex(self.df_el['peak_id'].values).values
+        found = ~np.isnan(rows)
+        for column, key in [('background_count', 'background'), ('net_count', 'net_count'),
+                            ('peak_to_background', 'peak_to_background'), ('detection_limit', 'detection_limit')]:
+            values = np.full(self.df_el.shape[0], np.nan)
+            values[found] = np.round(correction[key][rows[found].astype(np.int64)], 2)
+            self.df_el[column] = values
+
     # The binning operation which maps the peak according to the input table
     def start_binning(self):
         list_of_dict = []
@@ -3016,120 +3633,61 @@ class MainWindow(Ui_APTMainWindow.Ui_MainWindow, QMainWindow):
             if none_values > 0:
                 common.show_message("Input elements and complete the table to start binning..")
             else:
-                cutoff_bins = [float(i) for i in self.df_el['cutoff_bin'].values]
-                peak_MNRatio = [float(i) for i in self.df_el['peak_MNRatio'].values]
-                peak_width = [float(i) for i in self.df_el['peak_width'].values]
-                cutoff_height = [int(i) for i in self.df_el['cutoff_height'].values]
-                cutoff_width = [int(i) for i in self.df_el['cutoff_width'].values]
-
-                class_iter = 0
-                peak_no_max = 0
-                dict_sub_df = {}
-                dict_sub_df_hist = {}
-                dict_sub_df_merged = {}
-
-                while class_iter < self.df_el.shape[0]:
-                    self.completed = (class_iter / self.df_el.shape[0]) * 100.0
-                    self.progressBar.setValue(self.completed)
-                    reciprocal_bins = 1 / cutoff_bins[class_iter]
-                    MNRatio_start = float(peak_MNRatio[class_iter] - peak_width[class_iter] / 2.0)
-                    MNRatio_end = float(peak_MNRatio[class_iter] + peak_width[class_iter] / 2.0)
-                    dict_sub_df[class_iter] = self.df_apt[self.df_apt["MN_Ratio"].between(MNRatio_start, MNRatio_end)]
-                    num_bins = int(reciprocal_bins * (MNRatio_end - MNRatio_start))
-                    bin_intervals = np.linspace(MNRatio_start, MNRatio_end, num_bins)
-                    freq, bins = np.histogram(dict_sub_df[class_iter]["MN_Ratio"], bins=bin_intervals)
-
-                    def truncate(f, n):
-                        return math.floor(f * 10 ** n) / 10 ** n
-
-                    for ib in range(len(bins)):
-                        bins[ib] = truncate(bins[ib], np.log10(reciprocal_bins))
-
-                    # freq will become peaks if it satisfy the given height and width conditions
-                    dict_sub_df_hist[class_iter] = pd.DataFrame(list(zip(bins[:-1],
-                                                                         bins[:-1] +
-                                                                         cutoff_bins[class_iter],
-                                                                         freq)),
-                                                                columns=['bin_lower', 'bin_upper', 'freq'])
-
-                    dict_sub_df_hist[class_iter]['Range_Cutoff_H_Value'] = cutoff_height[class_iter]
-                    dict_sub_df_hist[class_iter]['Range_Cutoff_W_Value'] = cutoff_width[class_iter]
-
-                    def check_cutoff_height(row):
-                        if row['freq'] > row['Range_Cutoff_H_Value']:
-                            return True
-                        return False
-
-                    dict_sub_df_hist[class_iter]['cutoff_height_status'] = dict_sub_df_hist[class_iter].apply(
-                        lambda row: check_cutoff_height(row), axis=1)
-                    dict_sub_df_hist[class_iter]['subgroup'] = \
-                        (dict_sub_df_hist[class_iter]['cutoff_height_status'] !=
-                         dict_sub_df_hist[class_iter]['cutoff_height_status'].shift(1)).cumsum()
-                    dict_sub_df_hist[class_iter]['subgroup_freq'] = dict_sub_df_hist[class_iter].groupby('subgroup')[
-                        'subgroup'].transform('count')
-
-                    def check_cutoff_width(row):
-                        if row['subgroup_freq'] > row['Range_Cutoff_W_Value'] and row['cutoff_height_status'] is True:
-                            return True
-                        return False
-
-                    dict_sub_df_hist[class_iter]['cutoff_height_width_status'] = dict_sub_df_hist[class_iter].apply(
-                        lambda row: check_cutoff_width(row), axis=1)
-                    peak_cutoff_status = dict_sub_df_hist[class_iter]['cutoff_height_width_status'].tolist()
-
-                    if class_iter == 0:
-                        peak_no_iter = 0
-                        peak_no_max = 0
-                        peak_cutoff_status[0] = False
-                    else:
-                        peak_cutoff_status[0] = False
-                        for class_idx in range(class_iter):
-                            peak_no_max_idx = dict_sub_df_hist[class_idx]['peak_no'].max()
-                            peak_no_max = max(peak_no_max, peak_no_max_idx)
-
-                        peak_no_iter = peak_no_max
-
-                    peak = np.zeros(len(peak_cutoff_status), dtype=np.int64)
-                    for j in range(len(peak_cutoff_status)):
-                        if peak_cutoff_status[j] is False:
-                            peak[j] = 0
-                        if peak_cutoff_status[j] is True:
-                            if j > 0 and peak_cutoff_status[j - 1] is False:
-                                peak_no_iter = peak_no_iter + 1
-                            peak[j] = int(peak_no_iter)
-
-                    dict_sub_df_hist[class_iter]['peak_no'] = peak
-                    MN_Ratio = dict_sub_df[class_iter].MN_Ratio.values
-                    bin_lower = dict_sub_df_hist[class_iter].bin_lower.values
-                    bin_upper = dict_sub_df_hist[class_iter].bin_upper.values
-                    ii, jj = np.where((MN_Ratio[:, None] >= bin_lower) & (MN_Ratio[:, None] <= bin_upper))
-                    dict_sub_df_merged[class_iter] = pd.DataFrame(
-                        np.column_stack([dict_sub_df[class_iter].values[ii], dict_sub_df_hist[class_iter].values[jj]]),
-                        columns=dict_sub_df[class_iter].columns.append(dict_sub_df_hist[class_iter].columns))
-
-                    class_iter = class_iter + 1
-
-                df_apt_merged = pd.concat(dict_sub_df_merged.values(), ignore_index=True)
-
-                max_peak_no = df_apt_merged['peak_no'].max() + 1
+                # rows imported from range files keep their fixed range, the others are classified in their window
+                fixed = (self.df_el['cutoff_bin'].astype(str) == 'fixed').values
+                rows = list(zip([float(i) for i in self.df_el['peak_MNRatio'].values[~fixed]],
+                                [float(i) for i in self.df_el['peak_width'].values[~fixed]],
+                                [float(i) for i in self.df_el['cutoff_bin'].values[~fixed]],
+                                [int(i) for i in self.df_el['cutoff_height'].values[~fixed]],
+                                [int(i) for i in self.df_el['cutoff_width'].values[~fixed]]))
+
+                # only the rows whose parameters changed since the last run are classified again
+                classified = iter(ranging.classify_rows(self.spectrum_index, rows, cache=self.range_cache))
+                results = [ranging.fixed_range(float(peak), float(width)) if is_fixed else next(classified)
+                           for peak, width, is_fixed in zip(self.df_el['peak_MNRatio'].values,
+                                                            self.df_el['peak_width'].values, fixed)]
+                self.completed = 50
+                self.progressBar.setValue(self.completed)
+                # MN_Ratio interval and run length (in bins) of every peak found in the windows
+                peak_no_all, peak_low_all, peak_high_all, peak_run_all = ranging.number_peaks(results)
+
+                # overlapping windows used to count the same ions twice, now the peak starting first keeps them
+                overlaps = ranging.find_overlaps(peak_low_all, peak_high_all)
+                if len(overlaps) > 0:
+                    text = ", ".join("%.3f-%.3f / %.3f-%.3f" % (peak_low_all[a], peak_high_all[a], peak_low_all[b],
+                                                                 peak_high_all[b]) for a, b in overlaps[:10])
+                    common.show_message("%d overlapping peak ranges were found (the first one keeps the shared "
+                                        "ions): %s" % (len(overlaps), text))
+
+                # every ion gets its peak with one binary search over the compiled peak ranges
+                compiled = ranging.compile_ranges(peak_low_all, peak_high_all)
+                ion_peak = ranging.assign_ranges(self.spectrum_index['sorted'], compiled)
+                positions = np.flatnonzero(ion_peak >= 0)
+                df_apt_merged = self.df_apt.iloc[self.spectrum_index['order'][positions]].reset_index(drop=True)
+                df_apt_merged['peak_no'] = peak_no_all[ion_peak[positions]]
+
+                # the ions of a peak are contiguous in the sorted MN_Ratio values
+                found, first, count = np.unique(ion_peak[positions], return_index=True, return_counts=True)
+                found_min = self.spectrum_index['sorted'][positions[first]]
+                found_max = self.spectrum_index['sorted'][positions[first + count - 1]]
                 dict_peak_min_max_count = dict()
-
-                if max_peak_no > 1:
-                    for peak_id in range(1, max_peak_no):
-                        temp_df_apt = df_apt_merged[df_apt_merged["peak_no"] == peak_id]
-                        max_cutoff_width = temp_df_apt.subgroup_freq.mode()[0]
-                        peak_total_count = temp_df_apt.shape[0]
-                        dict_peak_min_max_count[peak_id] = peak_id, temp_df_apt['MN_Ratio'].min(), \
-                                                           temp_df_apt['MN_Ratio'].max(), max_cutoff_width, \
-                                                           peak_total_count
-
-                    def check_val_in_dict(peak_input, dict_peak_min_max_count):
-                        non_peaks = 0
-
-                        for key in dict_peak_min_max_count.keys():
-                            if dict_peak_min_max_count[key][1] < peak_input < dict_peak_min_max_count[key][2]:
-                                return pd.Series([int(dict_peak_min_max_count[key][0]),
-                                                  dict_peak_min_max_count[key][3], dict_peak_min_max_count[key][4]])
+                for k in range(len(found)):
+                    peak_id = int(peak_no_all[found[k]])
+                    dict_peak_min_max_count[peak_id] = peak_id, found_min[k], found_max[k], \
+                                                       int(peak_run_all[found[k]]), int(count[k])
+
+                if len(dict_peak_min_max_count) > 0:
+                    peak_ids = np.array(sorted(dict_peak_min_max_count.keys(), key=lambda key:
+                                               dict_peak_min_max_count[key][1]))
+                    peak_min = np.array([dict_peak_min_max_count[key][1] for key in peak_ids])
+                    peak_max = np.array([dict_peak_min_max_count[key][2] for key in peak_ids])
+
+                    def check_val_in_dict(peak_input):
+                        j = np.searchsorted(peak_min, peak_input, side='right') - 1
+                        if j >= 0 and peak_min[j] < peak_input < peak_max[j]:
+                            key = peak_ids[j]
+                            return pd.Series([int(dict_peak_min_max_count[key][0]),
+                                              dict_peak_min_max_count[key][3], dict_peak_min_max_count[key][4]])
                         message = "No peaks were observed with input cutoff_conditions at MN_Ratio: " + str(peak_input)
 
                         def scarce_element(peak_input):
@@ -3145,11 +3703,10 @@ class MainWindow(Ui_APTMainWindow.Ui_MainWindow, QMainWindow):
 
                             MNRatio_start = float(peak_input - tolerance / 2.0)
                             MNRatio_end = float(peak_input + tolerance / 2.0)
-                            df_apt_scarce = self.df_apt[self.df_apt["MN_Ratio"].between(MNRatio_start, MNRatio_end)]
                             reciprocal_bins = 1 / cutoff_bin
                             num_bins = int(reciprocal_bins * (MNRatio_end - MNRatio_start))
-                            bin_intervels = np.linspace(MNRatio_start, MNRatio_end, num_bins)
-                            freq, bins = np.histogram(df_apt_scarce["MN_Ratio"], bins=bin_intervels)
+                            bins = np.linspace(MNRatio_start, MNRatio_end, num_bins)
+                            freq = spectrum.histogram(self.spectrum_index, bins)
 
                             hist_apt_scarce = pd.DataFrame(list(zip(bins[:-1], bins[:-1] + cutoff_bin, freq)),
                                                            columns=['bin_lower', 'bin_upper', 'freq'])
@@ -3159,10 +3716,7 @@ class MainWindow(Ui_APTMainWindow.Ui_MainWindow, QMainWindow):
                             hist_apt_scarce['bin_upper'] = hist_apt_scarce['bin_upper'].round(
                                 int(np.log10(reciprocal_bins)))
 
-                            self.model = DataFrameModel(hist_apt_scarce)
-                            self.tableView.setModel(self.model)
-                            for i in range(hist_apt_scarce.shape[1]):
-                                self.tableView.horizontalHeader().setSectionResizeMode(i, QHeaderView.ResizeToContents)
+                            self.show_table(hist_apt_scarce)
 
                         common.show_message(message, btn1=True, btn1_name="View Scarce Element Table",
                                             btn1_fun=lambda: scarce_element(peak_input), btn2=True, btn2_name="OK",
@@ -3171,19 +3725,19 @@ class MainWindow(Ui_APTMainWindow.Ui_MainWindow, QMainWindow):
                         return pd.Series([float('nan'), float('nan'), 0])
 
                     self.df_el[['peak_id', 'peak_max_cutoff_width', 'XYZ_total_count']] = self.df_el[
-                        'peak_MNRatio'].apply(lambda x: check_val_in_dict(float(x), dict_peak_min_max_count))
+                        'peak_MNRatio'].apply(lambda x: check_val_in_dict(float(x)))
 
-                    self.df_apt_final = pd.merge(df_apt_merged, self.df_el, how='left', left_on='peak_no',
+                    # rows sharing a peak are deconvolved below, the ions are labelled with the first of them
+                    df_el_peaks = self.df_el.dropna(subset=['peak_id']).drop_duplicates(subset=['peak_id'])
+                    self.df_apt_final = pd.merge(df_apt_merged, df_el_peaks, how='left', left_on='peak_no',
                                                  right_on='peak_id')
                     self.df_apt_final = self.df_apt_final.dropna(subset=['ion'])
                     self.df_apt_final = self.df_apt_final.drop(
-                        columns=['bin_lower', 'bin_upper', 'freq', 'Range_Cutoff_H_Value',
-                                 'Range_Cutoff_W_Value', 'subgroup', 'subgroup_freq',
-                                 'cutoff_height_status', 'cutoff_height_width_status',
-                                 'peak_width', 'cutoff_bin', 'cutoff_height',
-                                 'cutoff_width', 'peak_id'])
+                        columns=['peak_width', 'cutoff_bin', 'cutoff_height', 'cutoff_width', 'peak_id'])
 
                     self.df_apt_final.groupby('peak_no')
+                    self.df_el['deconvolved_count'] = self.deconvolve_peaks(dict_peak_min_max_count)
+                    self.correct_background(dict_peak_min_max_count)
 
                 df_peak_min_max_count = pd.DataFrame(columns=['peak_id', 'min_MN', 'max_MN', 'peak_max_cutoff_width'])
                 for key in dict_peak_min_max_count.keys():
@@ -3206,7 +3760,11 @@ class MainWindow(Ui_APTMainWindow.Ui_MainWindow, QMainWindow):
                     return text
 
                 self.df_el['ION'] = self.df_el.apply(lambda row: change_ion_name(row), axis=1)
-                self.df_apt_final['ION'] = self.df_apt_final.apply(lambda row: change_ion_name(row), axis=1)
+                # the labels are built once per peak and broadcast to the ions through their peak numbers
+                df_peak_label = self.df_el.dropna(subset=['peak_id']).drop_duplicates(subset=['peak_id'])
+                label_codes = pd.Index(df_peak_label['peak_id'].astype(np.int64)).get_indexer(
+                    self.df_apt_final['peak_no'].astype(np.int64))
+                self.df_apt_final['ION'] = df_peak_label['ION'].values[label_codes]
 
                 df_temp = self.df_apt_final.groupby('peak_no')['MN_Ratio']
                 df_temp2 = self.df_apt_final.assign(min_MN_Ratio=df_temp.transform(min),
@@ -3219,8 +3777,11 @@ class MainWindow(Ui_APTMainWindow.Ui_MainWindow, QMainWindow):
 
                 self.df_el = self.df_el.drop(columns=['ion', 'num', 'charge', 'peak_width',
                                                       'cutoff_bin', 'cutoff_height', 'cutoff_width'])
-                cols = ['ION', 'mass', 'peak_MNRatio', 'peak_id', 'peak_max_cutoff_width', 'XYZ_total_count']
+                cols = ['ION', 'mass', 'peak_MNRatio', 'peak_id', 'peak_max_cutoff_width', 'XYZ_total_count',
+                        'deconvolved_count', 'background_count', 'net_count', 'peak_to_background', 'detection_limit']
                 self.df_el = self.df_el[cols]
+                # the analysis dialogs open the mapped dataset from the shared store, without exporting it first
+                datastore.publish_dataset(datastore.current_dataset, self.df_apt_final)
 
                 self.completed = 100
                 self.progressBar.setValue(self.completed)